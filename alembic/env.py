@@ -1,17 +1,29 @@
+import os
 from logging.config import fileConfig
 
-from sqlalchemy import engine_from_config, create_engine
+from sqlalchemy import engine_from_config, create_engine, make_url
 from sqlalchemy import pool
 
 from alembic import context
 
-from models.Base import Base
+from models.Base import Base, include_object
 
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
 
+# DATABASE_URL (the app's async URL) overrides alembic.ini; migrations
+# run with the synchronous driver of the same backend.
+database_url = os.getenv("DATABASE_URL")
+if database_url:
+    sync_url = make_url(database_url)
+    sync_url = sync_url.set(drivername=sync_url.get_backend_name())
+    config.set_main_option(
+        "sqlalchemy.url",
+        sync_url.render_as_string(hide_password=False).replace("%", "%%"),
+    )
+
 url = config.get_main_option("sqlalchemy.url")
 
 engine = create_engine(url)
@@ -49,6 +61,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -72,7 +85,8 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata,
+            include_object=include_object,
         )
 
         with context.begin_transaction():
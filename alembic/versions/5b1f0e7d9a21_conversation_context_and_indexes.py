@@ -0,0 +1,51 @@
+"""conversation context and indexes
+
+Revision ID: 5b1f0e7d9a21
+Revises: c423866c2ba3
+Create Date: 2026-10-18 10:12:04.417309
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b1f0e7d9a21'
+down_revision: Union[str, None] = 'c423866c2ba3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Databases created by the create_all startup hook after the summary and
+    # context columns were added to the model (before migrations existed)
+    # already have some of them; add only what is missing.
+    inspector = sa.inspect(op.get_bind())
+    existing = {column['name'] for column in inspector.get_columns('conversations')}
+    columns = [
+        sa.Column('summary', sa.Text(), nullable=True),
+        sa.Column('summary_upto_id', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('llm_context', sa.JSON(), nullable=True),
+        sa.Column('llm_context_model', sa.String(), nullable=True),
+        sa.Column('llm_context_upto_id', sa.Integer(), nullable=True),
+    ]
+    for column in columns:
+        if column.name not in existing:
+            op.add_column('conversations', column)
+    # History reads filter on the parent and order/page by id.
+    op.create_index('ix_messages_conversation_id_id', 'messages', ['conversation_id', 'id'])
+    op.create_index('ix_conversations_user_id_id', 'conversations', ['user_id', 'id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_conversations_user_id_id', table_name='conversations')
+    op.drop_index('ix_messages_conversation_id_id', table_name='messages')
+    op.drop_column('conversations', 'llm_context_upto_id')
+    op.drop_column('conversations', 'llm_context_model')
+    op.drop_column('conversations', 'llm_context')
+    op.drop_column('conversations', 'summary_upto_id')
+    op.drop_column('conversations', 'summary')
@@ -0,0 +1,48 @@
+"""conversation activity columns
+
+Revision ID: 7c5e9a0b3f18
+Revises: e81b27c4d6f3
+Create Date: 2026-10-18 18:21:40.117902
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c5e9a0b3f18'
+down_revision: Union[str, None] = 'e81b27c4d6f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Keep in sync with settings.LIST_PREVIEW_CHARS (default)
+PREVIEW_CHARS = 120
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('conversations', sa.Column('updated_at', sa.DateTime(timezone=True),
+                                             server_default=sa.func.now(), nullable=False))
+    op.add_column('conversations', sa.Column('message_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('conversations', sa.Column('last_message_preview', sa.String(), nullable=True))
+    # Messages carry no timestamps, so existing conversations start at the migration time.
+    op.execute(f"""
+        UPDATE conversations SET
+            message_count = (SELECT count(*) FROM messages WHERE messages.conversation_id = conversations.id),
+            last_message_preview = (
+                SELECT substr(content, 1, {PREVIEW_CHARS}) FROM messages
+                WHERE messages.conversation_id = conversations.id
+                ORDER BY messages.id DESC LIMIT 1
+            )
+    """)
+    op.create_index('ix_conversations_user_id_updated_at_id', 'conversations', ['user_id', 'updated_at', 'id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_conversations_user_id_updated_at_id', table_name='conversations')
+    op.drop_column('conversations', 'last_message_preview')
+    op.drop_column('conversations', 'message_count')
+    op.drop_column('conversations', 'updated_at')
@@ -0,0 +1,36 @@
+"""message full-text index
+
+Revision ID: a3d94c1e7f52
+Revises: 5b1f0e7d9a21
+Create Date: 2026-10-18 14:36:51.208113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3d94c1e7f52'
+down_revision: Union[str, None] = '5b1f0e7d9a21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # The expression must stay identical to chat.search.MESSAGE_TSVECTOR.
+    # Other databases search with the in-process index instead.
+    if op.get_bind().dialect.name == 'postgresql':
+        op.create_index(
+            'ix_messages_content_fts', 'messages',
+            [sa.text("to_tsvector('simple', coalesce(content, ''))")],
+            postgresql_using='gin',
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_messages_content_fts', table_name='messages')
@@ -20,13 +20,35 @@ depends_on: Union[str, Sequence[str], None] = None
 
 def upgrade() -> None:
     """Upgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    pass
-    # ### end Alembic commands ###
+    op.create_table(
+        'users',
+        sa.Column('id', sa.String(), nullable=False),
+        sa.Column('username', sa.String(), nullable=False),
+        sa.Column('hashed_password', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('username'),
+    )
+    op.create_table(
+        'conversations',
+        sa.Column('id', sa.String(), nullable=False),
+        sa.Column('conversation_name', sa.String(), nullable=True),
+        sa.Column('user_id', sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_table(
+        'messages',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('role', sa.String(), nullable=True),
+        sa.Column('content', sa.Text(), nullable=True),
+        sa.Column('conversation_id', sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(['conversation_id'], ['conversations.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
 
 
 def downgrade() -> None:
     """Downgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    pass
-    # ### end Alembic commands ###
+    op.drop_table('messages')
+    op.drop_table('conversations')
+    op.drop_table('users')
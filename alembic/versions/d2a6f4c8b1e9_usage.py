@@ -0,0 +1,37 @@
+"""usage
+
+Revision ID: d2a6f4c8b1e9
+Revises: 7c5e9a0b3f18
+Create Date: 2026-10-18 19:42:07.318455
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2a6f4c8b1e9'
+down_revision: Union[str, None] = '7c5e9a0b3f18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'usage',
+        sa.Column('user_key', sa.String(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('model', sa.String(), nullable=False),
+        sa.Column('requests', sa.Integer(), nullable=False),
+        sa.Column('prompt_tokens', sa.BigInteger(), nullable=False),
+        sa.Column('completion_tokens', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('user_key', 'day', 'model'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('usage')
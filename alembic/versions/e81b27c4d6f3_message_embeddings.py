@@ -0,0 +1,40 @@
+"""message embeddings
+
+Revision ID: e81b27c4d6f3
+Revises: a3d94c1e7f52
+Create Date: 2026-10-18 17:05:12.640218
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e81b27c4d6f3'
+down_revision: Union[str, None] = 'a3d94c1e7f52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'message_embeddings',
+        sa.Column('message_id', sa.Integer(), nullable=False),
+        sa.Column('conversation_id', sa.String(), nullable=False),
+        sa.Column('model', sa.String(), nullable=False),
+        sa.Column('embedding', sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(['conversation_id'], ['conversations.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['message_id'], ['messages.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('message_id'),
+    )
+    op.create_index('ix_message_embeddings_conversation_id_message_id', 'message_embeddings',
+                    ['conversation_id', 'message_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_message_embeddings_conversation_id_message_id', table_name='message_embeddings')
+    op.drop_table('message_embeddings')
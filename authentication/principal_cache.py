@@ -0,0 +1,96 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import event, inspect
+
+import settings
+from models.User import User
+
+
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated caller, without a round-trip to the users table."""
+    id: str
+    username: str
+
+
+class PrincipalCache:
+    """Bounded TTL cache of verified access token -> principal.
+
+    Entries never outlive the token itself. The cache is per process, so a
+    change made by another worker is only seen after ``ttl`` seconds.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()  # token -> (expires_at, principal)
+        self._tokens_by_user = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, token: str) -> Optional[Principal]:
+        entry = self._entries.get(token)
+        if entry is None or entry[0] < time.time():
+            if entry is not None:
+                self._remove(token)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, token: str, principal: Principal, token_exp: Optional[float] = None):
+        expires_at = time.time() + self.ttl
+        if token_exp is not None:
+            expires_at = min(expires_at, token_exp)
+        if token in self._entries:
+            self._remove(token)
+        self._entries[token] = (expires_at, principal)
+        self._tokens_by_user.setdefault(principal.id, set()).add(token)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, token: str):
+        _, principal = self._entries.pop(token)
+        tokens = self._tokens_by_user.get(principal.id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[principal.id]
+
+    def invalidate_user(self, user_id: str):
+        for token in list(self._tokens_by_user.get(user_id, ())):
+            self._remove(token)
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+
+principal_cache = PrincipalCache(
+    max_entries=settings.PRINCIPAL_CACHE_MAX_ENTRIES,
+    ttl=settings.PRINCIPAL_CACHE_TTL,
+)
+
+
+@event.listens_for(User, "after_delete")
+def _user_deleted(mapper, connection, target):
+    principal_cache.invalidate_user(target.id)
+
+
+@event.listens_for(User, "after_update")
+def _user_updated(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.hashed_password.history.has_changes() or state.attrs.username.history.has_changes():
+        principal_cache.invalidate_user(target.id)
@@ -1,11 +1,52 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+import settings
+
+# Pinning min/max rounds to the configured cost makes passlib report hashes
+# made with any other cost as needing an update, so they get rehashed on login.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.BCRYPT_ROUNDS,
+)
+
+# bcrypt releases the GIL, so a small thread pool keeps it off the event loop.
+_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash",
+)
+_pending = 0
+
+
+class PasswordServiceBusy(Exception):
+    """Raised when too many password operations are already queued."""
 
-def hash_password(password: str) -> str:
+
+async def _run(func, *args):
+    global _pending
+    if _pending >= settings.PASSWORD_HASH_MAX_PENDING:
+        raise PasswordServiceBusy("Too many concurrent password operations")
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+    finally:
+        _pending -= 1
+
+
+async def hash_password(password: str) -> str:
     """Hash a password using bcrypt."""
-    return pwd_context.hash(password)
+    return await _run(pwd_context.hash, password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against a hashed password."""
-    return pwd_context.verify(plain_password, hashed_password)
\ No newline at end of file
+    return await _run(pwd_context.verify, plain_password, hashed_password)
+
+async def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password and return a new hash if the stored one uses an outdated cost."""
+    return await _run(pwd_context.verify_and_update, plain_password, hashed_password)
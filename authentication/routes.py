@@ -1,13 +1,22 @@
 from fastapi import APIRouter, Depends, HTTPException
 from authentication.schemas import UserCreate, Token
 from authentication.user_handling import create_user, get_user_by_username
-from authentication.pswd_service import verify_password
+from authentication.pswd_service import verify_and_update, PasswordServiceBusy
 from authentication.jwt_handler import create_access_token
 from database import get_db
 from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
+
+def password_service_busy() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Too many authentication requests, try again later",
+        headers={"Retry-After": "1"},
+    )
+
+
 @router.post("/register")
 async def register_user(
         user_data: UserCreate,
@@ -17,7 +26,10 @@ async def register_user(
     if user:
         raise HTTPException(status_code=400, detail="Username already exists")
 
-    new_user = await create_user(db, user_data.username, user_data.password)
+    try:
+        new_user = await create_user(db, user_data.username, user_data.password)
+    except PasswordServiceBusy:
+        raise password_service_busy()
 
     return {"id": new_user.id, "username": new_user.username}
 
@@ -27,8 +39,19 @@ async def login_user(
         db: AsyncSession = Depends(get_db)
 ):
     user = await get_user_by_username(db, user_data.username)
-    if not user or not verify_password(user_data.password, user.hashed_password):
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    try:
+        valid, new_hash = await verify_and_update(user_data.password, user.hashed_password)
+    except PasswordServiceBusy:
+        raise password_service_busy()
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    if new_hash:
+        # The bcrypt cost setting changed since this hash was made.
+        user.hashed_password = new_hash
+        await db.commit()
 
     token = create_access_token(data={"sub": user.id})
 
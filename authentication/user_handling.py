@@ -10,7 +10,7 @@ async def create_user(
         username: str,
         password: str
 ):
-    user = User(username=username, hashed_password=hash_password(password))
+    user = User(username=username, hashed_password=await hash_password(password))
     db.add(user)
     await db.commit()
     await db.refresh(user)
@@ -0,0 +1,130 @@
+"""Stand-in for the Ollama HTTP API with configurable latency and token rate.
+
+Run on its own with::
+
+    python -m benchmarks.fake_ollama --port 11435 --latency 0.2 --token-rate 50
+"""
+import argparse
+import asyncio
+import json
+import time
+import zlib
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+         "tempor incididunt ut labore et dolore magna aliqua").split()
+EMBED_DIM = 256
+
+
+class FakeOllamaConfig:
+    def __init__(self, latency: float = 0.2, token_rate: float = 50.0, tokens: int = 64,
+                 prefill_per_1k_chars: float = 0.0):
+        # Fixed delay before the first token (model load + prefill)
+        self.latency = latency
+        # Generated tokens per second
+        self.token_rate = token_rate
+        # Tokens per completion
+        self.tokens = tokens
+        # Extra prefill delay per 1000 prompt characters
+        self.prefill_per_1k_chars = prefill_per_1k_chars
+
+
+def create_app(config: FakeOllamaConfig) -> FastAPI:
+    app = FastAPI()
+    app.state.config = config
+    app.state.loaded = {}
+
+    def first_token_delay(prompt: str) -> float:
+        return config.latency + config.prefill_per_1k_chars * len(prompt) / 1000
+
+    def final_chunk(model: str, prompt: str, context: list, started: float) -> dict:
+        prompt_tokens = len(prompt) // 4 + 1
+        eval_duration = int(config.tokens / config.token_rate * 1e9) if config.token_rate else 0
+        return {
+            "model": model,
+            "response": "",
+            "done": True,
+            "context": (context or []) + list(range(prompt_tokens + config.tokens)),
+            "prompt_eval_count": prompt_tokens,
+            "eval_count": config.tokens,
+            "eval_duration": eval_duration,
+            "total_duration": int((time.perf_counter() - started) * 1e9),
+        }
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        body = await request.json()
+        model = body.get("model", "")
+        prompt = body.get("prompt", "")
+        context = body.get("context") or []
+        started = time.perf_counter()
+        if body.get("keep_alive") == 0:
+            app.state.loaded.pop(model, None)
+            return {"model": model, "response": "", "done": True, "done_reason": "unload"}
+        app.state.loaded[model] = time.time()
+        if not prompt:
+            # An empty prompt only loads the model.
+            return {"model": model, "response": "", "done": True}
+
+        token_delay = 1 / config.token_rate if config.token_rate else 0.0
+        words = [WORDS[i % len(WORDS)] + " " for i in range(config.tokens)]
+
+        if body.get("stream", True):
+            async def stream():
+                await asyncio.sleep(first_token_delay(prompt))
+                for word in words:
+                    yield json.dumps({"model": model, "response": word, "done": False}) + "\n"
+                    await asyncio.sleep(token_delay)
+                yield json.dumps(final_chunk(model, prompt, context, started)) + "\n"
+
+            return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+        await asyncio.sleep(first_token_delay(prompt) + token_delay * config.tokens)
+        return {**final_chunk(model, prompt, context, started), "response": "".join(words)}
+
+    @app.post("/api/embed")
+    async def embed(request: Request):
+        # Hashed bag of words: texts sharing words get similar vectors.
+        body = await request.json()
+        texts = body.get("input", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        embeddings = []
+        for text in texts:
+            vector = [0.0] * EMBED_DIM
+            for word in text.lower().split():
+                vector[zlib.crc32(word.encode()) % EMBED_DIM] += 1.0
+            embeddings.append(vector)
+        app.state.loaded[body.get("model", "")] = time.time()
+        return {"model": body.get("model", ""), "embeddings": embeddings}
+
+    @app.get("/api/ps")
+    async def ps():
+        return {"models": [{"name": model, "model": model} for model in app.state.loaded]}
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": model, "model": model} for model in app.state.loaded]}
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--token-rate", type=float, default=50.0)
+    parser.add_argument("--tokens", type=int, default=64)
+    parser.add_argument("--prefill-per-1k-chars", type=float, default=0.0)
+    args = parser.parse_args()
+    config = FakeOllamaConfig(args.latency, args.token_rate, args.tokens, args.prefill_per_1k_chars)
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
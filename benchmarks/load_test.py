@@ -0,0 +1,274 @@
+"""Load test for the chat API against a local fake Ollama server.
+
+Boots the FastAPI app and the stub LLM server (benchmarks/fake_ollama.py) in
+one process, drives a mix of register/login/list/history/message traffic from
+concurrent virtual users and reports throughput and latency percentiles per
+endpoint, plus time-to-first-token for streamed replies::
+
+    python -m benchmarks.load_test --users 20 --duration 30 --output results.json
+    python -m benchmarks.load_test --stream --compare results.json
+
+By default a throwaway SQLite database is used; pass ``--database-url`` to run
+against Postgres (the schema is created if missing).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+
+DEFAULT_MIX = "login=1,list=4,history=4,message=2"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for item in mix.split(","):
+        name, weight = item.split("=")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(values: list) -> dict:
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else 0.0,
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.ttft = []
+
+    def record(self, endpoint: str, seconds: float, ok: bool):
+        self.latencies[endpoint].append(seconds)
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def report(self, elapsed: float) -> dict:
+        endpoints = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            endpoints[endpoint] = {
+                **summarize(values),
+                "errors": self.errors[endpoint],
+                "throughput": len(values) / elapsed if elapsed else 0.0,
+            }
+        total = sum(len(values) for values in self.latencies.values())
+        return {
+            "elapsed": elapsed,
+            "requests": total,
+            "throughput": total / elapsed if elapsed else 0.0,
+            "endpoints": endpoints,
+            "time_to_first_token": summarize(self.ttft),
+        }
+
+
+class VirtualUser:
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, index: int, stream: bool):
+        self.client = client
+        self.recorder = recorder
+        self.stream = stream
+        self.username = f"bench_{index}_{uuid.uuid4().hex[:8]}"
+        self.password = "benchmark-password"
+        self.headers = {}
+        self.conv_id = None
+
+    async def timed(self, endpoint: str, method: str, url: str, **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, headers=self.headers, **kwargs)
+            ok = response.is_success
+        except httpx.HTTPError:
+            response, ok = None, False
+        self.recorder.record(endpoint, time.perf_counter() - started, ok)
+        return response
+
+    async def setup(self):
+        await self.timed("register", "POST", "/auth/register",
+                         json={"username": self.username, "password": self.password})
+        await self.login()
+        self.conv_id = str(uuid.uuid4())
+        await self.timed("start", "POST", "/conversation/start", params={"conv_id": self.conv_id})
+
+    async def login(self):
+        response = await self.timed("login", "POST", "/auth/login",
+                                    json={"username": self.username, "password": self.password})
+        if response is not None and response.is_success:
+            self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def list(self):
+        await self.timed("list", "GET", "/conversation/list")
+
+    async def history(self):
+        await self.timed("history", "GET", f"/conversation/{self.conv_id}")
+
+    async def message(self):
+        body = {"prompt": f"Tell me something about {random.choice(['cats', 'rust', 'tea', 'jazz'])}",
+                "stream": self.stream}
+        url = f"/conversation/{self.conv_id}/message"
+        if not self.stream:
+            await self.timed("message", "POST", url, json=body)
+            return
+
+        started = time.perf_counter()
+        ok = False
+        try:
+            async with self.client.stream("POST", url, json=body, headers=self.headers) as response:
+                first_token = None
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if first_token is None and "token" in event:
+                        first_token = time.perf_counter() - started
+                        self.recorder.ttft.append(first_token)
+                    if event.get("done"):
+                        ok = True
+                    if "error" in event:
+                        break
+        except httpx.HTTPError:
+            pass
+        self.recorder.record("message", time.perf_counter() - started, ok)
+
+    async def run(self, weights: dict, deadline: float):
+        actions = list(weights)
+        values = [weights[action] for action in actions]
+        while time.perf_counter() < deadline:
+            await getattr(self, random.choices(actions, values)[0])()
+
+
+async def start_server(app, port: int):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def run(args) -> dict:
+    llm_port = free_port()
+    api_port = free_port()
+    os.environ.update({
+        "DATABASE_URL": args.database_url,
+        "OLLAMA_BASE_URL": f"http://127.0.0.1:{llm_port}",
+        "SCHEMA_CHECK": "off",
+        # Measure the server, not the per-user rate limit.
+        "RATE_LIMIT_PER_MINUTE": "0",
+    })
+    # settings are read at import time, so the app is imported only now.
+    from benchmarks.fake_ollama import create_app, FakeOllamaConfig
+    from database import engine
+    from main import app
+    from models.Base import Base
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    llm_app = create_app(FakeOllamaConfig(args.latency, args.token_rate, args.tokens, args.prefill_per_1k_chars))
+    llm_server, llm_task = await start_server(llm_app, llm_port)
+    api_server, api_task = await start_server(app, api_port)
+
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users * 2)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{api_port}", limits=limits,
+                                 timeout=args.timeout) as client:
+        users = [VirtualUser(client, recorder, i, args.stream) for i in range(args.users)]
+        await asyncio.gather(*(user.setup() for user in users))
+
+        started = time.perf_counter()
+        deadline = started + args.duration
+        weights = parse_mix(args.mix)
+        await asyncio.gather(*(user.run(weights, deadline) for user in users))
+        elapsed = time.perf_counter() - started
+
+    api_server.should_exit = True
+    llm_server.should_exit = True
+    await asyncio.gather(api_task, llm_task)
+    await engine.dispose()
+
+    report = recorder.report(elapsed)
+    report["config"] = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    return report
+
+
+def print_report(report: dict, baseline: dict = None):
+    print(f"{report['requests']} requests in {report['elapsed']:.1f}s ({report['throughput']:.1f} req/s)")
+    print(f"{'endpoint':<10} {'count':>7} {'err':>5} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for endpoint, stats in report["endpoints"].items():
+        line = (f"{endpoint:<10} {stats['count']:>7} {stats['errors']:>5} {stats['throughput']:>8.1f} "
+                f"{stats['p50'] * 1000:>9.1f} {stats['p95'] * 1000:>9.1f} {stats['p99'] * 1000:>9.1f}")
+        previous = (baseline or {}).get("endpoints", {}).get(endpoint)
+        if previous and previous["p95"]:
+            line += f"   p95 {(stats['p95'] / previous['p95'] - 1) * 100:+.1f}%"
+        print(line)
+    ttft = report["time_to_first_token"]
+    if ttft["count"]:
+        print(f"time to first token: p50 {ttft['p50'] * 1000:.1f} ms, "
+              f"p95 {ttft['p95'] * 1000:.1f} ms, p99 {ttft['p99'] * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the chat API against a fake Ollama server.")
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of traffic after setup")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"endpoint weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--stream", action="store_true", help="use streamed replies and measure TTFT")
+    parser.add_argument("--database-url", default=None,
+                        help="async SQLAlchemy URL (default: temporary SQLite database)")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake LLM delay before the first token")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="fake LLM tokens per second")
+    parser.add_argument("--tokens", type=int, default=64, help="fake LLM tokens per reply")
+    parser.add_argument("--prefill-per-1k-chars", type=float, default=0.0,
+                        help="extra fake LLM delay per 1000 prompt characters")
+    parser.add_argument("--timeout", type=float, default=120.0, help="client request timeout")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="JSON report of an earlier run to compare p95 against")
+    args = parser.parse_args()
+    if args.database_url is None:
+        args.database_url = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/bench.db"
+
+    report = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"report written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Check that an overloaded scheduler answers non-streamed turns with 429.
+
+Boots the API with a single generation slot and no queue next to the fake
+Ollama server, sends two non-streamed ``/conversation/{id}/message`` requests
+at once and expects one reply and one ``429`` with ``Retry-After``::
+
+    python -m benchmarks.overload_check
+
+Exits non-zero if the overload is reported any other way.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import uuid
+
+import httpx
+
+from benchmarks.load_test import free_port, start_server
+
+
+async def run(args) -> list:
+    llm_port = free_port()
+    api_port = free_port()
+    os.environ.update({
+        "DATABASE_URL": args.database_url,
+        "OLLAMA_BASE_URL": f"http://127.0.0.1:{llm_port}",
+        "SCHEMA_CHECK": "off",
+        "GENERATION_CONCURRENCY": "1",
+        "GENERATION_QUEUE_SIZE": "0",
+        "RATE_LIMIT_PER_MINUTE": "0",
+    })
+    # settings are read at import time, so the app is imported only now.
+    from benchmarks.fake_ollama import create_app, FakeOllamaConfig
+    from database import engine
+    from main import app
+    from models.Base import Base
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    llm_server, llm_task = await start_server(create_app(FakeOllamaConfig(args.latency, 50.0, 16, 0.0)), llm_port)
+    api_server, api_task = await start_server(app, api_port)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{api_port}", timeout=60) as client:
+            credentials = {"username": f"overload_{uuid.uuid4().hex[:8]}", "password": "overload-password"}
+            (await client.post("/auth/register", json=credentials)).raise_for_status()
+            login = await client.post("/auth/login", json=credentials)
+            login.raise_for_status()
+            client.headers["Authorization"] = f"Bearer {login.json()['access_token']}"
+            conv_ids = [str(uuid.uuid4()) for _ in range(2)]
+            for conv_id in conv_ids:
+                (await client.post("/conversation/start", params={"conv_id": conv_id})).raise_for_status()
+            return await asyncio.gather(*(
+                client.post(f"/conversation/{conv_id}/message", json={"prompt": "hello", "stream": False})
+                for conv_id in conv_ids
+            ))
+    finally:
+        api_server.should_exit = True
+        llm_server.should_exit = True
+        await asyncio.gather(api_task, llm_task)
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the 429 response of an overloaded scheduler.")
+    parser.add_argument("--database-url", default=None,
+                        help="async SQLAlchemy URL (default: temporary SQLite database)")
+    parser.add_argument("--latency", type=float, default=1.0, help="fake LLM delay, keeps the slot busy")
+    args = parser.parse_args()
+    if args.database_url is None:
+        args.database_url = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/overload.db"
+
+    responses = asyncio.run(run(args))
+    statuses = sorted(response.status_code for response in responses)
+    rejected = [response for response in responses if response.status_code == 429]
+    for response in responses:
+        print(response.status_code, response.headers.get("Retry-After"), response.text[:200])
+    if statuses != [200, 429] or not rejected[0].headers.get("Retry-After"):
+        print(f"expected one 200 and one 429 with Retry-After, got {statuses}", file=sys.stderr)
+        sys.exit(1)
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
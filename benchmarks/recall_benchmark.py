@@ -0,0 +1,94 @@
+"""Retrieval latency of semantic recall against conversation history size.
+
+Scores random normalized float32 embeddings with ``chat.recall.top_k`` (one
+matrix product plus a partial sort) and, for comparison, with a pure-Python
+loop over the same vectors::
+
+    python -m benchmarks.recall_benchmark --sizes 100,1000,10000,100000 --dim 768
+    python -m benchmarks.recall_benchmark --output recall.json
+
+No database or LLM is needed.
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.load_test import summarize
+from chat.recall import normalize, top_k
+
+
+def python_top_k(rows: list, query: list, k: int) -> list:
+    scores = [(sum(a * b for a, b in zip(row, query)), i) for i, row in enumerate(rows)]
+    return sorted(scores, reverse=True)[:k]
+
+
+def time_calls(fn, repeat: int) -> list:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def run(args) -> dict:
+    rng = np.random.default_rng(args.seed)
+    report = {"config": vars(args), "sizes": {}}
+    for size in args.sizes:
+        matrix = normalize(rng.standard_normal((size, args.dim), dtype=np.float32))
+        queries = normalize(rng.standard_normal((args.repeat, args.dim), dtype=np.float32))
+        mask = np.arange(size) < size - args.window
+        query_iter = iter(queries)
+
+        entry = {
+            "bytes": matrix.nbytes,
+            "numpy": summarize(time_calls(lambda: top_k(matrix, next(query_iter), args.k, mask), args.repeat)),
+            "numpy_batch_per_query": summarize([
+                seconds / args.repeat
+                for seconds in time_calls(lambda: top_k(matrix, queries, args.k), 5)
+            ]),
+        }
+        if size <= args.python_max:
+            rows, query = matrix.tolist(), queries[0].tolist()
+            entry["python"] = summarize(time_calls(lambda: python_top_k(rows, query, args.k), 5))
+        report["sizes"][size] = entry
+    return report
+
+
+def print_report(report: dict):
+    print(f"{'messages':>9} {'MiB':>8} {'numpy p50 ms':>13} {'p95 ms':>8} {'batched ms/q':>13} {'python p50 ms':>14}")
+    for size, entry in report["sizes"].items():
+        python = entry.get("python")
+        print(f"{size:>9} {entry['bytes'] / 2 ** 20:>8.2f} {entry['numpy']['p50'] * 1000:>13.3f} "
+              f"{entry['numpy']['p95'] * 1000:>8.3f} {entry['numpy_batch_per_query']['p50'] * 1000:>13.3f} "
+              f"{python['p50'] * 1000 if python else float('nan'):>14.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark semantic recall top-k against history size.")
+    parser.add_argument("--sizes", default="100,1000,10000,100000",
+                        type=lambda value: [int(size) for size in value.split(",")],
+                        help="comma-separated numbers of stored message embeddings")
+    parser.add_argument("--dim", type=int, default=768, help="embedding dimensions")
+    parser.add_argument("--k", type=int, default=3, help="turns recalled per query")
+    parser.add_argument("--window", type=int, default=20, help="newest messages excluded (already in the prompt)")
+    parser.add_argument("--repeat", type=int, default=200, help="queries per size")
+    parser.add_argument("--python-max", type=int, default=10000,
+                        help="largest size also timed with the pure-Python baseline")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"report written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
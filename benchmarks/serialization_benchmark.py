@@ -0,0 +1,98 @@
+"""Serialization time and bytes on the wire of the conversation history response.
+
+Builds synthetic conversations and serializes the ``GET /conversation/{id}``
+body the way FastAPI's default path does (``jsonable_encoder`` plus
+``json.dumps``) and the way the endpoint now does (``orjson``), then
+compresses the result with gzip and brotli at the configured levels::
+
+    python -m benchmarks.serialization_benchmark --sizes 1000,10000
+    python -m benchmarks.serialization_benchmark --output serialization.json
+
+No database or LLM is needed.
+"""
+import argparse
+import json
+import random
+import sys
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+from benchmarks.load_test import summarize
+from benchmarks.recall_benchmark import time_calls
+from compression import compress
+
+WORDS = ("the model answer context token request stream database conversation user assistant "
+         "summary history message latency prompt reply cache server client python ollama").split()
+
+
+def make_conversation(size: int, rng: random.Random, mean_words: int) -> dict:
+    messages = []
+    for msg_id in range(1, size + 1):
+        words = max(1, int(rng.expovariate(1 / mean_words)))
+        messages.append({
+            "id": msg_id,
+            "role": "user" if msg_id % 2 else "model",
+            "content": " ".join(rng.choice(WORDS) for _ in range(words)),
+        })
+    return {"id": "benchmark", "conversation_name": "Benchmark", "messages": messages, "has_more": False}
+
+
+def default_dumps(body: dict) -> bytes:
+    # What fastapi.responses.JSONResponse does after jsonable_encoder.
+    return json.dumps(
+        jsonable_encoder(body), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def run(args) -> dict:
+    rng = random.Random(args.seed)
+    report = {"config": vars(args), "sizes": {}}
+    for size in args.sizes:
+        body = make_conversation(size, rng, args.mean_words)
+        raw = orjson.dumps(body)
+        entry = {
+            "json_bytes": len(raw),
+            "default": summarize(time_calls(lambda: default_dumps(body), args.repeat)),
+            "orjson": summarize(time_calls(lambda: orjson.dumps(body), args.repeat)),
+        }
+        for encoding in ("gzip", "br"):
+            entry[encoding] = {
+                "bytes": len(compress(raw, encoding)),
+                "time": summarize(time_calls(lambda: compress(raw, encoding), args.repeat)),
+            }
+        report["sizes"][size] = entry
+    return report
+
+
+def print_report(report: dict):
+    print(f"{'messages':>9} {'KiB':>9} {'default ms':>11} {'orjson ms':>10} "
+          f"{'gzip KiB':>9} {'gzip ms':>8} {'br KiB':>8} {'br ms':>7}")
+    for size, entry in report["sizes"].items():
+        print(f"{size:>9} {entry['json_bytes'] / 1024:>9.1f} {entry['default']['p50'] * 1000:>11.2f} "
+              f"{entry['orjson']['p50'] * 1000:>10.2f} "
+              f"{entry['gzip']['bytes'] / 1024:>9.1f} {entry['gzip']['time']['p50'] * 1000:>8.2f} "
+              f"{entry['br']['bytes'] / 1024:>8.1f} {entry['br']['time']['p50'] * 1000:>7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark history response serialization and compression.")
+    parser.add_argument("--sizes", default="1000,10000",
+                        type=lambda value: [int(size) for size in value.split(",")],
+                        help="comma-separated numbers of messages per conversation")
+    parser.add_argument("--mean-words", type=int, default=60, help="average words per message")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per measurement")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"report written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+import settings
+
+
+class ResponseCache:
+    """LRU + TTL cache of generation results with single-flight coalescing.
+
+    Identical requests that arrive while a generation is running wait for that
+    generation instead of starting their own. Entries are evicted by age and
+    when either the entry count or the total cached text size exceeds its bound.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at, size, value)
+        self._inflight = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model: str, prompt: str, options: Optional[dict] = None) -> str:
+        normalized = {
+            "model": model.strip().lower(),
+            # Only surrounding whitespace is insignificant; inner newlines and
+            # indentation change the meaning of code and list prompts.
+            "prompt": prompt.strip(),
+            "options": options or {},
+        }
+        raw = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, size, value = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: dict):
+        size = len(value.get("response", "").encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, size, value)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    async def get_or_generate(self, key: str, generate: Callable[[], Awaitable[dict]]) -> dict:
+        cached = self.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            # Run the generation as its own task so one waiter disconnecting
+            # doesn't cancel it for everyone else.
+            task = asyncio.ensure_future(generate())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            result = task.result()
+            # Context token arrays are large and useless for stateless callers.
+            self.put(key, {k: v for k, v in result.items() if k != "context"})
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            "inflight": len(self._inflight),
+        }
+
+
+response_cache = ResponseCache(
+    max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+    ttl=settings.RESPONSE_CACHE_TTL,
+)
@@ -0,0 +1,173 @@
+import uuid
+from contextlib import contextmanager
+from typing import Awaitable, Callable
+
+import anyio
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from chat.streaming import ndjson
+from monitoring.metrics import observe_cancelled
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# Why a generation was aborted
+DISCONNECT = "disconnect"
+CANCEL_REQUEST = "request"
+
+
+class GenerationCancelled(Exception):
+    def __init__(self, reason: str):
+        super().__init__(f"Generation cancelled ({reason})")
+        self.reason = reason
+
+
+def request_id(request: Request) -> str:
+    """The client's ``X-Request-ID`` (so it can cancel before any reply) or a fresh one."""
+    value = request.headers.get(REQUEST_ID_HEADER, "").strip()
+    return value[:64] if value else uuid.uuid4().hex
+
+
+class Generation:
+    """A running generation that can be aborted from another task."""
+
+    def __init__(self, request_id: str, user_id: str, model: str):
+        self.request_id = request_id
+        self.user_id = user_id
+        self.model = model
+        self.scope = anyio.CancelScope()
+        self.reason = None
+        # Tokens produced before the abort, for the tokens-saved estimate
+        self.generated_tokens = 0
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def cancel(self, reason: str):
+        if self.reason is None:
+            self.reason = reason
+            self.scope.cancel()
+
+
+class GenerationRegistry:
+    """Running generations by ``(user, request id)``, for explicit cancels."""
+
+    def __init__(self):
+        self._running = {}
+
+    @contextmanager
+    def track(self, generation: Generation):
+        key = (generation.user_id, generation.request_id)
+        self._running[key] = generation
+        try:
+            yield generation
+        finally:
+            if self._running.get(key) is generation:
+                del self._running[key]
+            if generation.cancelled:
+                observe_cancelled(generation.model, generation.reason, generation.generated_tokens)
+
+    def cancel(self, user_id: str, request_id: str) -> bool:
+        generation = self._running.get((user_id, request_id))
+        if generation is None:
+            return False
+        generation.cancel(CANCEL_REQUEST)
+        return True
+
+    def stats(self) -> dict:
+        return {"running": len(self._running)}
+
+
+generation_registry = GenerationRegistry()
+
+
+async def _watch_disconnect(receive, generation: Generation):
+    # The request body has been read, so the next message is the disconnect.
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            generation.cancel(DISCONNECT)
+            return
+
+
+@contextmanager
+def _unwrap_task_group_error():
+    # anyio task groups wrap errors in an exception group; callers expect
+    # the original exception (SchedulerBusy, LLMError, ...).
+    try:
+        yield
+    except BaseExceptionGroup as group:
+        if len(group.exceptions) == 1:
+            raise group.exceptions[0]
+        raise
+
+
+async def run_cancellable(request: Request, generation: Generation, generate: Callable[[], Awaitable]):
+    """Await ``generate()`` unless the client disconnects or cancels first.
+
+    Cancelling abandons the upstream request, which closes the connection to
+    Ollama and makes it stop generating. Raises ``GenerationCancelled``;
+    errors of ``generate()`` propagate unchanged.
+    """
+    result = None
+    with generation_registry.track(generation), generation.scope, _unwrap_task_group_error():
+        async with anyio.create_task_group() as tasks:
+            tasks.start_soon(_watch_disconnect, request.receive, generation)
+            try:
+                result = await generate()
+            finally:
+                tasks.cancel_scope.cancel()
+    if result is None and generation.cancelled:
+        raise GenerationCancelled(generation.reason)
+    return result
+
+
+class CancellableStreamingResponse(StreamingResponse):
+    """Streaming response whose generation stops on disconnect or cancel.
+
+    The body runs inside the generation's cancel scope, so aborting it closes
+    the upstream stream right away even while no token is flowing (queue wait,
+    prompt processing). After an explicit cancel the stream is ended with a
+    ``{"cancelled": true}`` event.
+    """
+
+    def __init__(self, content, generation: Generation, **kwargs):
+        super().__init__(content, **kwargs)
+        self.generation = generation
+        self.headers[REQUEST_ID_HEADER] = generation.request_id
+
+    async def __call__(self, scope, receive, send):
+        started = completed = False
+
+        async def send_wrapper(message):
+            nonlocal started, completed
+            await send(message)
+            if message["type"] == "http.response.start":
+                started = True
+            elif not message.get("more_body", False):
+                completed = True
+
+        generation = self.generation
+        with generation_registry.track(generation):
+            with generation.scope, _unwrap_task_group_error():
+                async with anyio.create_task_group() as tasks:
+                    tasks.start_soon(_watch_disconnect, receive, generation)
+                    try:
+                        await self.stream_response(send_wrapper)
+                    except OSError:
+                        generation.cancel(DISCONNECT)
+                    finally:
+                        tasks.cancel_scope.cancel()
+                        # A failed or cancelled send leaves the body generator
+                        # suspended; closing it releases the upstream stream.
+                        await self.body_iterator.aclose()
+            if generation.reason == CANCEL_REQUEST and not completed:
+                if not started:
+                    await send({"type": "http.response.start", "status": self.status_code,
+                                "headers": self.raw_headers})
+                await send({"type": "http.response.body",
+                            "body": ndjson({"cancelled": True, "request_id": generation.request_id}),
+                            "more_body": False})
+        if self.background is not None:
+            await self.background()
+
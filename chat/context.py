@@ -0,0 +1,197 @@
+import logging
+from dataclasses import dataclass, field
+from typing import Optional
+
+from sqlalchemy import func, update
+from sqlalchemy.future import select
+
+import settings
+from chat.llm_client import LLMError
+from chat.scheduler import scheduled_generate, SchedulerBusy
+from database import AsyncSessionLocal
+from models.Conversation import Conversation as ConvModel
+from models.Message import Message as MsgModel
+
+CHARS_PER_TOKEN = 4
+
+# Conversations with a summary update already running in this process
+_summarizing: set = set()
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate; good enough for budgeting without a tokenizer."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def context_budget(model: str) -> int:
+    return settings.MODEL_CONTEXT_BUDGETS.get(model, settings.DEFAULT_CONTEXT_BUDGET)
+
+
+def format_turn(role: str, content: str) -> str:
+    return f"{role} : {content}"
+
+
+@dataclass
+class PromptContext:
+    prompt: str
+    # Oldest message kept verbatim; everything older must come from the summary
+    window_start_id: Optional[int] = None
+    # Unsummarized messages were left out because of the budget
+    truncated: bool = False
+    # Extra generate options, e.g. the cached Ollama context to continue from
+    options: dict = field(default_factory=dict)
+
+
+def _reusable_context(conversation: ConvModel, recent: list, prompt: str, model: str):
+    """Return the cached Ollama context if it still describes the conversation exactly."""
+    if not conversation.llm_context or conversation.llm_context_model != model:
+        return None
+    if len(conversation.llm_context) + estimate_tokens(prompt) > context_budget(model):
+        return None
+    # Any message written outside the generation path (or a removed one)
+    # leaves the stored context pointing at a different history.
+    latest_id = recent[0][0] if recent else None
+    if latest_id != conversation.llm_context_upto_id:
+        return None
+    return conversation.llm_context
+
+
+def context_values(model: str, data: Optional[dict], upto_id: int) -> dict:
+    """Column values that remember (or invalidate) the context returned with a reply."""
+    context = (data or {}).get("context")
+    if not context:
+        return {"llm_context": None, "llm_context_model": None, "llm_context_upto_id": None}
+    return {"llm_context": context, "llm_context_model": model, "llm_context_upto_id": upto_id}
+
+
+def build_prompt(
+        conversation: ConvModel,
+        recent: list,
+        user_prompt: str,
+        model: str,
+        recalled: list = ()
+) -> PromptContext:
+    """Build the prompt for the next turn.
+
+    ``recent`` holds the newest unsummarized ``(id, role, content)`` rows,
+    newest first, as returned by ``get_conversation_for_turn``. Follow-up turns
+    on the same model continue from the cached Ollama context so only the new
+    message is prefilled. Otherwise the prompt is rebuilt from the rolling
+    summary, the ``recalled`` older turns (chronological ``(id, role, content)``
+    rows) and the newest turns that fit the budget.
+    """
+    cached = _reusable_context(conversation, recent, user_prompt, model)
+    if cached is not None:
+        return PromptContext(prompt=user_prompt, options={"context": cached})
+
+    summary = conversation.summary or ""
+    used = estimate_tokens(user_prompt) + estimate_tokens(summary)
+    budget = context_budget(model)
+
+    # Recalled turns may take at most half the budget; recent turns matter more.
+    relevant = []
+    for _, role, content in recalled:
+        turn = format_turn(role, content)
+        cost = estimate_tokens(turn)
+        if used + cost > budget // 2:
+            break
+        used += cost
+        relevant.append(turn)
+
+    window = []
+    window_start_id = None
+    for msg_id, role, content in recent[:settings.CONTEXT_MAX_MESSAGES]:
+        turn = format_turn(role, content)
+        cost = estimate_tokens(turn)
+        if used + cost > budget:
+            break
+        used += cost
+        window.append(turn)
+        window_start_id = msg_id
+    window.reverse()
+
+    sections = []
+    if summary:
+        sections.append(f"Summary of the earlier conversation:\n{summary}\n")
+    if relevant:
+        sections.append("Relevant earlier messages:")
+        sections.extend(relevant)
+        sections.append("")
+    sections.append("Conversation history:")
+    sections.extend(window)
+    sections.append("")
+    sections.append(f"user: {user_prompt}\nassistant:")
+
+    return PromptContext(
+        prompt="\n".join(sections),
+        window_start_id=window_start_id,
+        truncated=len(window) < len(recent),
+    )
+
+
+def _summary_prompt(summary: str, turns: list) -> str:
+    return f"""You maintain a running summary of a chat between a user and an assistant.
+Update the summary with the new messages below. Keep facts, names, decisions and open questions; drop small talk.
+Answer with the updated summary only, in at most {settings.SUMMARY_MAX_CHARS // 6} words.
+
+Current summary:
+{summary or "(empty)"}
+
+New messages:
+{chr(10).join(turns)}
+
+Updated summary:"""
+
+
+async def update_summary(conv_id: str, model: str, fold_before_id: Optional[int]):
+    """Fold turns that fell out of the prompt window into the conversation summary.
+
+    Runs as a background task after a reply; at most one batch is folded per call,
+    so the summary catches up incrementally instead of re-reading the whole chat.
+    """
+    if conv_id in _summarizing:
+        return
+    _summarizing.add(conv_id)
+    try:
+        async with AsyncSessionLocal() as db:
+            conv = await db.get(ConvModel, conv_id)
+            if conv is None:
+                return
+            upto_id = conv.summary_upto_id
+            filters = [MsgModel.conversation_id == conv_id, MsgModel.id > upto_id]
+            if fold_before_id is not None:
+                filters.append(MsgModel.id < fold_before_id)
+
+            pending = await db.scalar(select(func.count()).select_from(MsgModel).where(*filters))
+            if pending < settings.SUMMARY_MIN_BATCH:
+                return
+
+            result = await db.execute(
+                select(MsgModel.id, MsgModel.role, MsgModel.content)
+                .where(*filters)
+                .order_by(MsgModel.id)
+                .limit(settings.SUMMARY_MAX_BATCH)
+            )
+            rows = result.all()
+            summary = conv.summary or ""
+            await db.commit()
+
+            data = await scheduled_generate(
+                "system:summary",
+                settings.SUMMARY_MODEL or model,
+                _summary_prompt(summary, [format_turn(role, content) for _, role, content in rows]),
+            )
+            new_summary = data["response"].strip()[:settings.SUMMARY_MAX_CHARS]
+
+            # Only apply if nobody folded the same range in the meantime.
+            await db.execute(
+                update(ConvModel)
+                .where(ConvModel.id == conv_id, ConvModel.summary_upto_id == upto_id)
+                .values(summary=new_summary, summary_upto_id=rows[-1].id)
+            )
+            await db.commit()
+            logging.info(f"Folded {len(rows)} messages into summary of conversation {conv_id}")
+    except (LLMError, SchedulerBusy) as e:
+        logging.error(f"Error updating summary for conversation {conv_id}: {e}")
+    finally:
+        _summarizing.discard(conv_id)
@@ -0,0 +1,503 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from contextlib import aclosing
+from typing import Optional
+
+import httpx
+
+import settings
+from monitoring.metrics import LLM_ERRORS, LLM_TIME_TO_FIRST_TOKEN, observe_llm_result
+
+RETRYABLE_STATUS_CODES = {502, 503, 504}
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+
+class LLMError(Exception):
+    """Raised when the LLM backend fails to produce a response.
+
+    ``backend_fault`` is false for errors caused by the request itself (unknown
+    model, bad options); those are not worth retrying on another backend.
+    """
+
+    def __init__(self, message: str, backend_fault: bool = True):
+        super().__init__(message)
+        self.backend_fault = backend_fault
+
+
+def _status_error(e: httpx.HTTPStatusError) -> LLMError:
+    return LLMError(str(e), backend_fault=e.response.status_code >= 500)
+
+
+class LLMClient:
+    """Async client for the Ollama HTTP API backed by a keep-alive connection pool."""
+
+    def __init__(
+            self,
+            base_url: str,
+            connect_timeout: float,
+            read_timeout: float,
+            max_retries: int,
+            retry_backoff: float,
+            max_connections: int,
+            max_keepalive_connections: int,
+            keepalive_expiry: float,
+    ):
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._client: httpx.AsyncClient | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self._timeout,
+                limits=self._limits,
+            )
+        return self._client
+
+    async def start(self):
+        """Open the connection pool; also done lazily on first use."""
+        return self.client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _post(self, path: str, payload: dict) -> dict:
+        # Only failures that happen before the model starts working are retried,
+        # a read timeout means the generation itself is slow and retrying it
+        # would just double the load on the backend.
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self.client.post(path, json=payload)
+                if response.status_code in RETRYABLE_STATUS_CODES and attempt < self.max_retries:
+                    logging.warning(f"LLM backend returned {response.status_code}, retrying")
+                    await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+                    continue
+                response.raise_for_status()
+                try:
+                    return response.json()
+                except ValueError as e:
+                    raise LLMError(f"Invalid response from LLM backend: {e}") from e
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise LLMError(str(e)) from e
+                logging.warning(f"LLM backend connection failed ({e}), retrying")
+                await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+            except httpx.HTTPStatusError as e:
+                raise _status_error(e) from e
+            except httpx.HTTPError as e:
+                raise LLMError(str(e)) from e
+        raise LLMError("LLM backend is unavailable")
+
+    async def generate(self, model: str, prompt: str, **options) -> dict:
+        """Run a non-streaming completion and return the raw Ollama response."""
+        payload = {"model": model, "prompt": prompt, "stream": False, **options}
+        started = time.perf_counter()
+        try:
+            data = await self._post("/api/generate", payload)
+            if not data.get("response"):
+                raise LLMError("Missing 'response' in external API response", backend_fault=False)
+        except LLMError:
+            LLM_ERRORS.labels(model).inc()
+            raise
+        observe_llm_result(model, "generate", started, data)
+        return data
+
+    async def stream_generate(self, model: str, prompt: str, **options):
+        """Yield Ollama's NDJSON chunks as they arrive."""
+        payload = {"model": model, "prompt": prompt, "stream": True, **options}
+        requested = time.perf_counter()
+        first_token = False
+        try:
+            for attempt in range(self.max_retries + 1):
+                started = False
+                try:
+                    async with self.client.stream("POST", "/api/generate", json=payload) as response:
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            if not line:
+                                continue
+                            try:
+                                chunk = json.loads(line)
+                            except ValueError as e:
+                                raise LLMError(f"Invalid stream chunk from LLM backend: {e}") from e
+                            if "error" in chunk:
+                                raise LLMError(chunk["error"], backend_fault=False)
+                            started = True
+                            if not first_token and chunk.get("response"):
+                                first_token = True
+                                LLM_TIME_TO_FIRST_TOKEN.labels(model).observe(time.perf_counter() - requested)
+                            if chunk.get("done"):
+                                observe_llm_result(model, "stream", requested, chunk)
+                            yield chunk
+                    return
+                except RETRYABLE_ERRORS as e:
+                    # Once tokens went out to the caller the stream can't be replayed.
+                    if started or attempt >= self.max_retries:
+                        raise LLMError(str(e)) from e
+                    logging.warning(f"LLM backend connection failed ({e}), retrying")
+                    await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+                except httpx.HTTPStatusError as e:
+                    raise _status_error(e) from e
+                except httpx.HTTPError as e:
+                    raise LLMError(str(e)) from e
+        except LLMError:
+            LLM_ERRORS.labels(model).inc()
+            raise
+
+
+    async def embed(self, model: str, texts: list, **options) -> list:
+        """Embedding vectors of ``texts``, in order."""
+        try:
+            data = await self._post("/api/embed", {"model": model, "input": texts, **options})
+            embeddings = data.get("embeddings")
+            if not embeddings or len(embeddings) != len(texts):
+                raise LLMError("Missing 'embeddings' in external API response", backend_fault=False)
+        except LLMError:
+            LLM_ERRORS.labels(model).inc()
+            raise
+        return embeddings
+
+    async def loaded_models(self) -> dict:
+        """Models the server currently holds in memory, by name."""
+        try:
+            response = await self.client.get("/api/ps", timeout=5.0)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            raise LLMError(str(e)) from e
+        return {
+            model["name"]: {"expires_at": model.get("expires_at"), "size_vram": model.get("size_vram")}
+            for model in response.json().get("models", [])
+        }
+
+    async def load_model(self, model: str, keep_alive=None):
+        """Load ``model`` into memory without generating anything."""
+        payload = {"model": model}
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        await self._post("/api/generate", payload)
+
+    async def unload_model(self, model: str):
+        await self._post("/api/generate", {"model": model, "keep_alive": 0})
+
+
+class Backend:
+    """One Ollama server in the pool and what the router knows about it."""
+
+    def __init__(self, client: LLMClient):
+        self.client = client
+        self.outstanding = 0
+        # model name -> residency reported by /api/ps (expiry, VRAM)
+        self.loaded_models = {}
+        self.unhealthy_until = 0.0
+        self.failures = 0
+
+    @property
+    def url(self) -> str:
+        return self.client.base_url
+
+    def available(self) -> bool:
+        return self.unhealthy_until <= time.monotonic()
+
+    def has_model(self, model: str) -> bool:
+        # Ollama reports "llama3.2:latest" for a request of "llama3.2".
+        return model in self.loaded_models or f"{model}:latest" in self.loaded_models
+
+    def forget_model(self, model: str):
+        self.loaded_models.pop(model, None)
+        self.loaded_models.pop(f"{model}:latest", None)
+
+
+class LLMRouter:
+    """Spreads generations over a pool of Ollama servers.
+
+    Picks the healthy backend with the fewest outstanding requests, preferring
+    ones that already have the model loaded and, for conversations, the backend
+    that served the previous turn (its KV cache is still warm). A backend that
+    errors or times out is skipped for ``failure_cooldown`` seconds and the
+    request fails over to the next candidate.
+
+    ``warm_models`` are loaded on every backend at startup and reloaded by the
+    health loop whenever a backend no longer holds them, so users don't pay
+    the model load time. Every request carries the model's keep-alive policy,
+    as Ollama resets a model's expiry with each request.
+    """
+
+    def __init__(
+            self,
+            clients: list,
+            health_interval: float,
+            failure_cooldown: float,
+            affinity_size: int,
+            warm_models: list = (),
+            keep_alive: Optional[dict] = None,
+            default_keep_alive=None,
+            warmup_timeout: float = 120.0,
+    ):
+        self.backends = [Backend(client) for client in clients]
+        self.health_interval = health_interval
+        self.failure_cooldown = failure_cooldown
+        self.affinity_size = affinity_size
+        self.warm_models = set(warm_models)
+        self.keep_alive = keep_alive or {}
+        self.default_keep_alive = default_keep_alive
+        self.warmup_timeout = warmup_timeout
+        self._affinity: OrderedDict = OrderedDict()  # affinity key -> Backend
+        self._health_task: Optional[asyncio.Task] = None
+        self._warmup_task: Optional[asyncio.Task] = None
+        self._loading = set()  # (backend url, model) loads in flight
+
+    async def start(self):
+        for backend in self.backends:
+            await backend.client.start()
+        await self.check_health()
+        if self.warm_models:
+            # Hold startup until the warm models are loaded, within reason.
+            self._start_warmup()
+            done, _ = await asyncio.wait({self._warmup_task}, timeout=self.warmup_timeout)
+            if not done:
+                logging.warning(f"Model warm-up still running after {self.warmup_timeout}s, serving anyway")
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        for task in (self._health_task, self._warmup_task):
+            if task is not None:
+                task.cancel()
+        self._health_task = self._warmup_task = None
+        for backend in self.backends:
+            await backend.client.close()
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check_health()
+            if self.warm_models:
+                self._start_warmup()
+
+    def keep_alive_for(self, model: str):
+        if model in self.keep_alive:
+            return self.keep_alive[model]
+        if model in self.warm_models:
+            return -1
+        return self.default_keep_alive
+
+    def _with_keep_alive(self, model: str, options: dict) -> dict:
+        keep_alive = self.keep_alive_for(model)
+        if keep_alive is None or "keep_alive" in options:
+            return options
+        return {**options, "keep_alive": keep_alive}
+
+    def _start_warmup(self):
+        if self._warmup_task is None or self._warmup_task.done():
+            self._warmup_task = asyncio.create_task(self._load_missing())
+
+    async def _load(self, backend: Backend, model: str) -> str:
+        key = (str(backend.url), model)
+        if key in self._loading:
+            return "loading"
+        self._loading.add(key)
+        started = time.perf_counter()
+        try:
+            await backend.client.load_model(model, self.keep_alive_for(model))
+        except LLMError as e:
+            logging.warning(f"Loading {model} on LLM backend {backend.url} failed: {e}")
+            return f"error: {e}"
+        finally:
+            self._loading.discard(key)
+        backend.loaded_models.setdefault(model, {})
+        logging.info(f"Loaded {model} on LLM backend {backend.url} in {time.perf_counter() - started:.1f}s")
+        return "loaded"
+
+    async def _load_missing(self):
+        await asyncio.gather(*(
+            self._load(backend, model)
+            for model in self.warm_models
+            for backend in self.backends
+            if backend.available() and not backend.has_model(model)
+        ))
+
+    async def preload(self, model: str) -> dict:
+        """Load ``model`` on every available backend and keep it resident."""
+        self.warm_models.add(model)
+        backends = [backend for backend in self.backends if backend.available()]
+        results = await asyncio.gather(*(self._load(backend, model) for backend in backends))
+        return {str(backend.url): result for backend, result in zip(backends, results)}
+
+    async def evict(self, model: str) -> dict:
+        """Unload ``model`` from every backend and stop keeping it warm."""
+        self.warm_models.discard(model)
+
+        async def unload(backend: Backend) -> str:
+            try:
+                await backend.client.unload_model(model)
+            except LLMError as e:
+                return f"error: {e}"
+            backend.forget_model(model)
+            return "evicted"
+
+        results = await asyncio.gather(*(unload(backend) for backend in self.backends))
+        return {str(backend.url): result for backend, result in zip(self.backends, results)}
+
+    def residency(self) -> dict:
+        """Which models are loaded where, and the keep-alive policy."""
+        return {
+            "warm_models": sorted(self.warm_models),
+            "keep_alive": {**self.keep_alive, "*": self.default_keep_alive},
+            "backends": {
+                str(backend.url): {"healthy": backend.available(), "models": backend.loaded_models}
+                for backend in self.backends
+            },
+        }
+
+    async def check_health(self):
+        async def probe(backend: Backend):
+            try:
+                backend.loaded_models = await backend.client.loaded_models()
+            except LLMError as e:
+                logging.warning(f"LLM backend {backend.url} failed health check: {e}")
+                self._mark_failed(backend)
+            else:
+                backend.unhealthy_until = 0.0
+                backend.failures = 0
+
+        await asyncio.gather(*(probe(backend) for backend in self.backends))
+
+    def _mark_failed(self, backend: Backend):
+        backend.failures += 1
+        backend.unhealthy_until = time.monotonic() + self.failure_cooldown
+
+    def _mark_served(self, backend: Backend, model: str, affinity_key: Optional[str]):
+        backend.failures = 0
+        backend.loaded_models.setdefault(model, {})
+        if affinity_key is not None:
+            self._affinity[affinity_key] = backend
+            self._affinity.move_to_end(affinity_key)
+            while len(self._affinity) > self.affinity_size:
+                self._affinity.popitem(last=False)
+
+    def _candidates(self, model: str, affinity_key: Optional[str]) -> list:
+        # With every backend in cooldown still try them all rather than fail outright.
+        healthy = [backend for backend in self.backends if backend.available()] or list(self.backends)
+        healthy.sort(key=lambda backend: (not backend.has_model(model), backend.outstanding))
+        preferred = self._affinity.get(affinity_key) if affinity_key is not None else None
+        if preferred in healthy and preferred.has_model(model):
+            healthy.remove(preferred)
+            healthy.insert(0, preferred)
+        return healthy
+
+    async def generate(self, model: str, prompt: str, affinity_key: Optional[str] = None, **options) -> dict:
+        last_error = LLMError("No LLM backends configured")
+        options = self._with_keep_alive(model, options)
+        for backend in self._candidates(model, affinity_key):
+            backend.outstanding += 1
+            try:
+                data = await backend.client.generate(model, prompt, **options)
+            except LLMError as e:
+                if not e.backend_fault:
+                    raise
+                logging.warning(f"LLM backend {backend.url} failed, trying next one: {e}")
+                self._mark_failed(backend)
+                last_error = e
+                continue
+            finally:
+                backend.outstanding -= 1
+            self._mark_served(backend, model, affinity_key)
+            return data
+        raise last_error
+
+    async def stream_generate(self, model: str, prompt: str, affinity_key: Optional[str] = None, **options):
+        last_error = LLMError("No LLM backends configured")
+        options = self._with_keep_alive(model, options)
+        for backend in self._candidates(model, affinity_key):
+            started = False
+            backend.outstanding += 1
+            try:
+                async with aclosing(backend.client.stream_generate(model, prompt, **options)) as chunks:
+                    async for chunk in chunks:
+                        started = True
+                        yield chunk
+            except LLMError as e:
+                if not e.backend_fault:
+                    raise
+                self._mark_failed(backend)
+                # A stream that already produced tokens can't move to another backend.
+                if started:
+                    raise
+                logging.warning(f"LLM backend {backend.url} failed, trying next one: {e}")
+                last_error = e
+                continue
+            finally:
+                backend.outstanding -= 1
+            self._mark_served(backend, model, affinity_key)
+            return
+        raise last_error
+
+    async def embed(self, model: str, texts: list, **options) -> list:
+        options = self._with_keep_alive(model, options)
+        last_error = LLMError("No LLM backends configured")
+        for backend in self._candidates(model, None):
+            backend.outstanding += 1
+            try:
+                embeddings = await backend.client.embed(model, texts, **options)
+            except LLMError as e:
+                if not e.backend_fault:
+                    raise
+                logging.warning(f"LLM backend {backend.url} failed, trying next one: {e}")
+                self._mark_failed(backend)
+                last_error = e
+                continue
+            finally:
+                backend.outstanding -= 1
+            self._mark_served(backend, model, None)
+            return embeddings
+        raise last_error
+
+    def stats(self) -> dict:
+        return {
+            backend.url: {
+                "healthy": backend.available(),
+                "outstanding": backend.outstanding,
+                "failures": backend.failures,
+                "loaded_models": sorted(backend.loaded_models),
+            }
+            for backend in self.backends
+        }
+
+
+
+llm_client = LLMRouter(
+    clients=[
+        LLMClient(
+            base_url=base_url,
+            connect_timeout=settings.OLLAMA_CONNECT_TIMEOUT,
+            read_timeout=settings.OLLAMA_READ_TIMEOUT,
+            max_retries=settings.OLLAMA_MAX_RETRIES,
+            retry_backoff=settings.OLLAMA_RETRY_BACKOFF,
+            max_connections=settings.OLLAMA_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.OLLAMA_KEEPALIVE_EXPIRY,
+        )
+        for base_url in settings.OLLAMA_BACKENDS
+    ],
+    health_interval=settings.LLM_HEALTH_INTERVAL,
+    failure_cooldown=settings.LLM_FAILURE_COOLDOWN,
+    affinity_size=settings.LLM_AFFINITY_SIZE,
+    warm_models=settings.WARM_MODELS,
+    keep_alive=settings.MODEL_KEEP_ALIVE,
+    default_keep_alive=settings.DEFAULT_KEEP_ALIVE,
+    warmup_timeout=settings.WARMUP_TIMEOUT,
+)
@@ -0,0 +1,82 @@
+import math
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from fastapi import HTTPException
+
+import settings
+from monitoring.metrics import RATE_LIMITED
+
+
+class BucketStore(ABC):
+    """Where token bucket levels live.
+
+    ``take`` must be atomic per key. The in-process store limits each worker
+    separately; an implementation backed by a shared store (e.g. a Redis
+    script) makes the limit hold across workers.
+    """
+
+    @abstractmethod
+    async def take(self, key: str, rate: float, capacity: int, cost: float = 1.0) -> float:
+        """Take ``cost`` tokens; returns 0 on success, else seconds until they are available."""
+
+
+class InMemoryBucketStore(BucketStore):
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        # key -> (tokens, last update); least recently used first. An evicted
+        # bucket simply starts full again.
+        self._buckets: OrderedDict = OrderedDict()
+
+    async def take(self, key: str, rate: float, capacity: int, cost: float = 1.0) -> float:
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class RateLimiter:
+    """Token bucket per key: ``per_minute`` sustained with bursts of ``burst``."""
+
+    def __init__(self, store: BucketStore, per_minute: float, burst: int):
+        self.store = store
+        self.rate = per_minute / 60
+        self.burst = max(1, burst)
+        self.limited = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    async def acquire(self, key: str) -> float:
+        if not self.enabled:
+            return 0.0
+        return await self.store.take(key, self.rate, self.burst)
+
+    async def enforce(self, key: str, endpoint: str):
+        """Raise 429 with ``Retry-After`` if ``key`` is over its limit."""
+        wait = await self.acquire(key)
+        if wait > 0:
+            self.limited += 1
+            RATE_LIMITED.labels(endpoint).inc()
+            raise HTTPException(
+                status_code=429,
+                detail="Rate limit exceeded",
+                headers={"Retry-After": str(max(1, math.ceil(wait)))},
+            )
+
+
+rate_limiter = RateLimiter(
+    store=InMemoryBucketStore(),
+    per_minute=settings.RATE_LIMIT_PER_MINUTE,
+    burst=settings.RATE_LIMIT_BURST,
+)
@@ -0,0 +1,279 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+import settings
+from chat.llm_client import LLMError, llm_client
+from chat.repository import upsert_insert
+from chat.scheduler import scheduler, SchedulerBusy
+from database import AsyncSessionLocal
+from models.Message import Message as MsgModel
+from models.MessageEmbedding import MessageEmbedding as EmbeddingModel
+
+# Embeddings are stored as little-endian float32, 4 bytes per dimension.
+DTYPE = np.dtype("<f4")
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize rows so that a dot product is the cosine similarity."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def encode(vector: np.ndarray) -> bytes:
+    return vector.astype(DTYPE).tobytes()
+
+
+def decode(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype=DTYPE)
+
+
+def top_k(matrix: np.ndarray, queries: np.ndarray, k: int, mask: Optional[np.ndarray] = None):
+    """Best ``k`` rows of ``matrix`` by cosine similarity, for one or many queries.
+
+    Rows of ``matrix`` and ``queries`` must be normalized. ``mask`` excludes
+    rows where it is false. Returns ``(indices, scores)``, best first, shaped
+    like the queries (1-D for a single query).
+    """
+    single = np.ndim(queries) == 1
+    scores = np.atleast_2d(queries) @ matrix.T
+    if mask is not None:
+        scores = np.where(mask, scores, -np.inf)
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        shape = (0,) if single else (scores.shape[0], 0)
+        return np.empty(shape, dtype=np.int64), np.empty(shape)
+    # argpartition is O(n); only the k winners get sorted.
+    indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    best = np.take_along_axis(scores, indices, axis=1)
+    order = np.argsort(-best, axis=1)
+    indices = np.take_along_axis(indices, order, axis=1)
+    best = np.take_along_axis(best, order, axis=1)
+    return (indices[0], best[0]) if single else (indices, best)
+
+
+class _Vectors:
+    """Embeddings of one conversation: message ids and a normalized matrix."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.matrix = None
+        self._known = set()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, message_id: int) -> bool:
+        return message_id in self._known
+
+    @property
+    def last_id(self) -> int:
+        return int(self.ids.max()) if len(self.ids) else 0
+
+    def extend(self, ids: list, matrix: np.ndarray):
+        """Add vectors; ids already present are skipped."""
+        if self.matrix is not None and self.matrix.shape[1] != matrix.shape[1]:
+            # The embedding model changed dimensions; start over.
+            self.reset()
+        keep = [i for i, msg_id in enumerate(ids) if msg_id not in self._known]
+        if not keep:
+            return
+        if len(keep) < len(ids):
+            ids, matrix = [ids[i] for i in keep], matrix[keep]
+        self._known.update(ids)
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        self.matrix = matrix if self.matrix is None else np.vstack([self.matrix, matrix])
+
+
+class Recall:
+    """Embedding-based retrieval of older turns for the prompt.
+
+    New messages are embedded in the background after each turn, and older
+    messages without an embedding are backfilled a batch at a time. At prompt
+    time the user's message is embedded and the conversation's stored vectors
+    are scored in one matrix product. Vectors are cached per conversation and
+    only embeddings missing from the cache are read from the database.
+    ``embed`` is any ``async (model, texts) -> list of vectors``.
+    """
+
+    def __init__(
+            self,
+            embed: Callable[[str, list], Awaitable[list]],
+            model: Optional[str],
+            top_k: int,
+            min_score: float,
+            timeout: float,
+            batch_size: int,
+            cache_size: int,
+    ):
+        self.embed = embed
+        self.model = model
+        self.top_k = top_k
+        self.min_score = min_score
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._cache: OrderedDict = OrderedDict()  # conversation id -> _Vectors
+        self._embedding: set = set()  # conversations with an embedding task running
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.model)
+
+    async def _embed(self, texts: list, user_key: str) -> np.ndarray:
+        async with scheduler.slot(self.model, user_key):
+            vectors = await self.embed(self.model, texts)
+        return normalize(vectors)
+
+    def _cached(self, conv_id: str) -> _Vectors:
+        vectors = self._cache.get(conv_id)
+        if vectors is None:
+            vectors = self._cache[conv_id] = _Vectors()
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        self._cache.move_to_end(conv_id)
+        return vectors
+
+    async def _read(self, db: AsyncSession, vectors: _Vectors, filters: list):
+        result = await db.execute(
+            select(EmbeddingModel.message_id, EmbeddingModel.embedding)
+            .where(*filters)
+            .order_by(EmbeddingModel.message_id)
+        )
+        rows = result.all()
+        if rows:
+            vectors.extend([msg_id for msg_id, _ in rows], np.vstack([decode(data) for _, data in rows]))
+
+    async def _load(self, db: AsyncSession, conv_id: str) -> _Vectors:
+        """Bring the cached vectors of a conversation up to date with the table.
+
+        New turns have ids above the cached ones, but backfill (by any worker)
+        adds older ids, so the stored count decides whether those must be
+        looked up too. A conversation that is up to date costs one small query.
+        """
+        vectors = self._cached(conv_id)
+        filters = [EmbeddingModel.conversation_id == conv_id, EmbeddingModel.model == self.model]
+        result = await db.execute(
+            select(func.count(), func.max(EmbeddingModel.message_id)).where(*filters)
+        )
+        count, last_id = result.one()
+        if count < len(vectors):
+            # Messages (and their embeddings) were deleted; reload.
+            vectors.reset()
+        if count == len(vectors):
+            return vectors
+        if (last_id or 0) > vectors.last_id:
+            await self._read(db, vectors, filters + [EmbeddingModel.message_id > vectors.last_id])
+        if count > len(vectors):
+            result = await db.execute(select(EmbeddingModel.message_id).where(*filters))
+            missing = [msg_id for (msg_id,) in result.all() if msg_id not in vectors]
+            if missing:
+                await self._read(db, vectors, filters + [EmbeddingModel.message_id.in_(missing)])
+        return vectors
+
+    async def _query_vector(self, conv_id: str, user_key: str, text: str) -> Optional[np.ndarray]:
+        try:
+            return (await asyncio.wait_for(self._embed([text], user_key), self.timeout))[0]
+        except (asyncio.TimeoutError, LLMError, SchedulerBusy) as e:
+            logging.warning(f"Skipping recall for conversation {conv_id}: {e!r}")
+            return None
+
+    async def recall(
+            self,
+            db: AsyncSession,
+            conv_id: str,
+            user_key: str,
+            text: str,
+            before_id: int
+    ) -> list:
+        """The older ``(id, role, content)`` turns most similar to ``text``.
+
+        Only messages with an id below ``before_id`` (those not in the prompt
+        window) are considered. Returns them in chronological order.
+        """
+        if not self.enabled:
+            return []
+        query, vectors = await asyncio.gather(
+            self._query_vector(conv_id, user_key, text),
+            self._load(db, conv_id),
+        )
+        rows = []
+        if query is not None and len(vectors) and vectors.matrix.shape[1] == query.shape[0]:
+            indices, scores = top_k(vectors.matrix, query, self.top_k, mask=vectors.ids < before_id)
+            ids = [int(vectors.ids[i]) for i, score in zip(indices, scores) if score >= self.min_score]
+            if ids:
+                result = await db.execute(
+                    select(MsgModel.id, MsgModel.role, MsgModel.content)
+                    .where(MsgModel.id.in_(ids))
+                    .order_by(MsgModel.id)
+                )
+                rows = [tuple(row) for row in result.all()]
+        await db.commit()
+        return rows
+
+    async def embed_messages(self, conv_id: str):
+        """Background task: embed the conversation's newest messages without a vector.
+
+        Runs after each turn, so the new turn is embedded first and older
+        history is backfilled ``batch_size`` messages per turn.
+        """
+        if not self.enabled or conv_id in self._embedding:
+            return
+        self._embedding.add(conv_id)
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    select(MsgModel.id, MsgModel.content)
+                    .outerjoin(EmbeddingModel, EmbeddingModel.message_id == MsgModel.id)
+                    .where(
+                        MsgModel.conversation_id == conv_id,
+                        EmbeddingModel.message_id.is_(None),
+                        MsgModel.content != "",
+                    )
+                    .order_by(MsgModel.id.desc())
+                    .limit(self.batch_size)
+                )
+                rows = result.all()
+                await db.commit()
+                if not rows:
+                    return
+
+                matrix = await self._embed([content for _, content in rows], "system:embeddings")
+                await db.execute(
+                    upsert_insert(db, EmbeddingModel)
+                    .on_conflict_do_nothing(index_elements=[EmbeddingModel.message_id]),
+                    [
+                        {"message_id": msg_id, "conversation_id": conv_id, "model": self.model,
+                         "embedding": encode(vector)}
+                        for (msg_id, _), vector in zip(rows, matrix)
+                    ],
+                )
+                await db.commit()
+            if conv_id in self._cache:
+                self._cache[conv_id].extend([msg_id for msg_id, _ in rows], matrix)
+        except (LLMError, SchedulerBusy) as e:
+            logging.error(f"Error embedding messages of conversation {conv_id}: {e}")
+        finally:
+            self._embedding.discard(conv_id)
+
+
+recall = Recall(
+    embed=llm_client.embed,
+    model=settings.EMBED_MODEL,
+    top_k=settings.RECALL_TOP_K,
+    min_score=settings.RECALL_MIN_SCORE,
+    timeout=settings.RECALL_TIMEOUT,
+    batch_size=settings.EMBED_BATCH_SIZE,
+    cache_size=settings.RECALL_CACHE_CONVERSATIONS,
+)
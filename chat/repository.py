@@ -0,0 +1,259 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import and_, case, func, insert, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+import settings
+
+from models.Conversation import Conversation as ConvModel
+from models.Message import Message as MsgModel
+
+
+def upsert_insert(db: AsyncSession, table):
+    """Dialect-specific INSERT that supports ON CONFLICT."""
+    if db.bind.dialect.name == "sqlite":
+        return sqlite.insert(table)
+    return postgresql.insert(table)
+
+
+async def create_conversation(
+        db: AsyncSession,
+        conv_id: str,
+        conv_name: str,
+        user_id: str
+):
+    """Insert a conversation; returns ``None`` if the id is already taken."""
+    result = await db.execute(
+        upsert_insert(db, ConvModel)
+        .values(id=conv_id, conversation_name=conv_name, user_id=user_id)
+        .on_conflict_do_nothing(index_elements=[ConvModel.id])
+        .returning(ConvModel.id, ConvModel.conversation_name)
+    )
+    row = result.first()
+    await db.commit()
+    return row
+
+
+async def rename_conversation(
+        db: AsyncSession,
+        conv_id: str,
+        user_id: str,
+        conv_name: str
+):
+    """Rename a conversation of the user; returns ``None`` if there is none."""
+    result = await db.execute(
+        update(ConvModel)
+        .where(ConvModel.id == conv_id, ConvModel.user_id == user_id)
+        .values(conversation_name=conv_name)
+        .returning(ConvModel.id, ConvModel.conversation_name)
+    )
+    row = result.first()
+    await db.commit()
+    return row
+
+
+def preview(content: str) -> str:
+    return (content or "")[:settings.LIST_PREVIEW_CHARS]
+
+
+def _encode_cursor(updated_at: datetime, conv_id: str) -> str:
+    raw = json.dumps([updated_at.isoformat(), conv_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def _decode_cursor(cursor: str):
+    try:
+        updated_at, conv_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(updated_at), conv_id
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+async def list_conversations(
+        db: AsyncSession,
+        user_id: str,
+        limit: int,
+        cursor: Optional[str] = None
+):
+    """One page of the user's conversations, most recently active first.
+
+    Reads the activity columns kept up to date on write, so this is a single
+    index range scan on ``(user_id, updated_at, id)``. Returns
+    ``(conversations, next_cursor)``; ``next_cursor`` is ``None`` on the last
+    page. Raises ``ValueError`` for a malformed cursor.
+    """
+    statement = (
+        select(
+            ConvModel.id,
+            ConvModel.conversation_name,
+            ConvModel.updated_at,
+            ConvModel.message_count,
+            ConvModel.last_message_preview,
+        )
+        .where(ConvModel.user_id == user_id)
+        .order_by(ConvModel.updated_at.desc(), ConvModel.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor is not None:
+        statement = statement.where(
+            tuple_(ConvModel.updated_at, ConvModel.id) < tuple_(*_decode_cursor(cursor))
+        )
+    rows = (await db.execute(statement)).all()
+    next_cursor = _encode_cursor(rows[limit - 1].updated_at, rows[limit - 1].id) if len(rows) > limit else None
+    return [
+        {
+            "id": row.id,
+            "conversation_name": row.conversation_name,
+            "updated_at": row.updated_at.isoformat(),
+            "message_count": row.message_count,
+            "last_message_preview": row.last_message_preview,
+        }
+        for row in rows[:limit]
+    ], next_cursor
+
+
+async def get_conversation_for_turn(
+        db: AsyncSession,
+        conv_id: str,
+        user_id: str,
+        window: int
+):
+    """Load a conversation of the user with its newest unsummarized messages.
+
+    Ownership check and history read are a single query. Returns
+    ``(conversation, messages)``: the conversation columns a turn needs and the
+    messages as ``(id, role, content)`` rows, newest first, or ``(None, [])``
+    if the user has no such conversation.
+
+    The read transaction is closed before returning, so no connection is
+    held while the model generates.
+    """
+    # The join repeats the conversation on every message row; the large
+    # summary and cached context are only sent with the first one.
+    first = func.row_number().over(order_by=MsgModel.id.desc()) == 1
+    result = await db.execute(
+        select(
+            ConvModel.conversation_name,
+            ConvModel.summary_upto_id,
+            ConvModel.llm_context_model,
+            ConvModel.llm_context_upto_id,
+            case((first, ConvModel.summary)).label("summary"),
+            case((first, ConvModel.llm_context)).label("llm_context"),
+            MsgModel.id.label("msg_id"),
+            MsgModel.role,
+            MsgModel.content,
+        )
+        .outerjoin(MsgModel, and_(
+            MsgModel.conversation_id == ConvModel.id,
+            MsgModel.id > ConvModel.summary_upto_id,
+        ))
+        .where(ConvModel.id == conv_id, ConvModel.user_id == user_id)
+        .order_by(MsgModel.id.desc())
+        .limit(window)
+    )
+    rows = result.all()
+    await db.commit()
+    if not rows:
+        return None, []
+    messages = [(row.msg_id, row.role, row.content) for row in rows if row.msg_id is not None]
+    return rows[0], messages
+
+
+async def get_history_page(
+        db: AsyncSession,
+        conv_id: str,
+        user_id: str,
+        before: Optional[int],
+        after: Optional[int],
+        limit: int
+):
+    """Read one page of messages together with the conversation in one query.
+
+    Returns ``(conversation_row, messages, has_more)`` with messages in
+    chronological order, or ``(None, [], False)`` if the user has no such
+    conversation.
+    """
+    join_on = [MsgModel.conversation_id == ConvModel.id]
+    if before is not None:
+        join_on.append(MsgModel.id < before)
+    if after is not None:
+        join_on.append(MsgModel.id > after)
+    forward = after is not None and before is None
+
+    result = await db.execute(
+        select(ConvModel.id, ConvModel.conversation_name, MsgModel.id, MsgModel.role, MsgModel.content)
+        .outerjoin(MsgModel, and_(*join_on))
+        .where(ConvModel.id == conv_id, ConvModel.user_id == user_id)
+        .order_by(MsgModel.id if forward else MsgModel.id.desc())
+        .limit(limit + 1)
+    )
+    rows = result.all()
+    if not rows:
+        return None, [], False
+
+    conversation = rows[0]
+    messages = [
+        {"id": msg_id, "role": role, "content": content}
+        for _, _, msg_id, role, content in rows[:limit]
+        if msg_id is not None
+    ]
+    if not forward:
+        messages.reverse()
+    return conversation, messages, len(rows) > limit
+
+
+async def save_turn(
+        db: AsyncSession,
+        conv_id: str,
+        user_prompt: str,
+        reply: str,
+        conversation_values=None
+):
+    """Store a user message and the model reply in one transaction.
+
+    The conversation's activity columns are updated in the same transaction.
+    ``conversation_values`` maps the id of the stored reply to column values
+    for the conversation row (e.g. the cached LLM context). Returns the ids
+    of the stored ``(user_message, reply)``.
+    """
+    result = await db.execute(
+        insert(MsgModel).returning(MsgModel.id, sort_by_parameter_order=True),
+        [
+            {"role": "user", "content": user_prompt, "conversation_id": conv_id},
+            {"role": "model", "content": reply, "conversation_id": conv_id},
+        ],
+    )
+    prompt_id, reply_id = result.scalars().all()
+    await db.execute(
+        update(ConvModel)
+        .where(ConvModel.id == conv_id)
+        .values(
+            updated_at=func.now(),
+            message_count=ConvModel.message_count + 2,
+            last_message_preview=preview(reply),
+            **(conversation_values(reply_id) if conversation_values is not None else {}),
+        )
+    )
+    await db.commit()
+    return prompt_id, reply_id
+
+
+async def set_generated_title(
+        db: AsyncSession,
+        conv_id: str,
+        title: str,
+        expected_name: str
+) -> bool:
+    """Set a generated title unless the conversation was renamed meanwhile."""
+    result = await db.execute(
+        update(ConvModel)
+        .where(ConvModel.id == conv_id, ConvModel.conversation_name == expected_name)
+        .values(conversation_name=title)
+    )
+    await db.commit()
+    return result.rowcount > 0
@@ -1,49 +1,78 @@
-from fastapi import APIRouter, Depends, HTTPException
-import requests
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from authentication.principal_cache import Principal
+from chat.cache import response_cache
+from chat.cancellation import generation_registry
+from chat.context import context_budget
+from chat.llm_client import LLMError
+from chat.ratelimit import rate_limiter
+from chat.scheduler import scheduler, scheduled_generate, scheduled_stream, SchedulerBusy, too_many_requests
 from chat.schemas import Query
+from chat.streaming import relay_tokens, NDJSON_MEDIA_TYPE
+from chat.titles import title_prompt
 from database import get_db
+from dependencies import get_current_user
 
 router = APIRouter(prefix="/generation", tags=["Generation"])
 
-@router.post("/generate_chat_name")
-async def generate_chat_name(query: Query):
-    try:
-        prompt = f"""You are a helpful assistant whose only job is to create concise chat titles. 
-Given the very first user message, generate a title in exactly 3–5 words that captures its specific topic—nothing generic or off-topic.
-
-Examples:
-User message: "How to make pull ups?"
-Title: "How to Do Pull-Ups"
+def client_key(request: Request) -> str:
+    # The generation endpoints are anonymous, so fairness is per client address.
+    return f"ip:{request.client.host if request.client else 'unknown'}"
 
-User message: "Tips for installing Python packages on Windows"
-Title: "Installing Python Packages on Windows"
 
-User message: "What’s the best way to learn guitar chords?"
-Title: "Learning Guitar Chords Effectively"
+async def cached_generate(query: Query, prompt: str, user_key: str) -> dict:
+    """Generate through the response cache unless the caller opted out."""
+    options = query.llm_options()
+    if not query.cache:
+        return await scheduled_generate(user_key, query.model, prompt, **options)
+    key = response_cache.make_key(query.model, prompt, query.options)
+    return await response_cache.get_or_generate(
+        key, lambda: scheduled_generate(user_key, query.model, prompt, **options)
+    )
 
-User message: "How can I improve my sleep schedule?"
-Title: "Improving Your Sleep Schedule"
 
----
-User message: "{query.prompt}"
-Title:"""
-        response = requests.post(
-            "http://localhost:11434/api/generate",
-            json={"model": query.model, "prompt": prompt, "stream": query.stream},
-        )
-        response.raise_for_status()
-        return {"generated_text": response.json()["response"]}
-    except requests.RequestException as e:
+@router.post("/generate_chat_name")
+async def generate_chat_name(query: Query, request: Request):
+    await rate_limiter.enforce(client_key(request), "generate_chat_name")
+    try:
+        prompt = title_prompt(query.prompt)
+        data = await cached_generate(query, prompt, client_key(request))
+        return {"generated_text": data["response"]}
+    except SchedulerBusy as e:
+        raise too_many_requests(e)
+    except LLMError as e:
         raise HTTPException(status_code=500, detail=f"Error communicating with Ollama: {str(e)}")
 
 @router.post("/generate")
-async def generate_text(query: Query):
-    try:
-        response = requests.post(
-            "http://localhost:11434/api/generate",
-            json={"model": query.model, "prompt": query.prompt, "stream": query.stream},
+async def generate_text(query: Query, request: Request):
+    await rate_limiter.enforce(client_key(request), "generate")
+    if query.stream:
+        try:
+            scheduler.check_admission(query.model)
+        except SchedulerBusy as e:
+            raise too_many_requests(e)
+        return StreamingResponse(
+            relay_tokens(
+                scheduled_stream(client_key(request), query.model, query.prompt, **query.llm_options())
+            ),
+            media_type=NDJSON_MEDIA_TYPE,
         )
-        response.raise_for_status()
-        return {"generated_text": response.json()["response"]}
-    except requests.RequestException as e:
+    try:
+        data = await cached_generate(query, query.prompt, client_key(request))
+        return {"generated_text": data["response"]}
+    except SchedulerBusy as e:
+        raise too_many_requests(e)
+    except LLMError as e:
         raise HTTPException(status_code=500, detail=f"Error communicating with Ollama: {str(e)}")
+
+@router.get("/models/{model}/budget")
+async def get_context_budget(model: str):
+    return {"model": model, "context_budget": context_budget(model)}
+
+
+@router.post("/cancel/{request_id}")
+async def cancel_generation(request_id: str, current_user: Principal = Depends(get_current_user)):
+    """Abort a running conversation generation of the user by its ``X-Request-ID``."""
+    if not generation_registry.cancel(current_user.id, request_id):
+        raise HTTPException(status_code=404, detail="No running generation with this request id")
+    return {"request_id": request_id, "cancelled": True}
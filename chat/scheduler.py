@@ -0,0 +1,191 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import aclosing, asynccontextmanager
+
+from fastapi import HTTPException
+
+import settings
+from chat.llm_client import llm_client
+from chat.usage import usage_accountant
+
+
+class SchedulerBusy(Exception):
+    """Raised when a generation can't be admitted before its deadline."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Generation queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def too_many_requests(e: SchedulerBusy) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Generation queue is full",
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+class _Lane:
+    """Concurrency slots and per-user wait queues of one model."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.waiting = 0
+        # user key -> waiters; the first user is served next and then rotated
+        # to the end, which gives round-robin across users.
+        self.queues: OrderedDict = OrderedDict()
+        self.avg_service_time = 1.0
+
+
+class GenerationScheduler:
+    """In-process admission control for LLM generations.
+
+    Each model gets a bounded number of concurrent generations. Callers beyond
+    that wait in per-user FIFO queues served round-robin, so a burst from one
+    user can't starve the others. A request is rejected with ``SchedulerBusy``
+    when the queue is full or its expected wait exceeds ``max_wait``.
+    """
+
+    def __init__(self, default_limit: int, model_limits: dict, max_queue: int, max_wait: float):
+        self.default_limit = default_limit
+        self.model_limits = model_limits
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._lanes = {}
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_observed_wait = 0.0
+
+    def _lane(self, model: str) -> _Lane:
+        lane = self._lanes.get(model)
+        if lane is None:
+            lane = self._lanes[model] = _Lane(self.model_limits.get(model, self.default_limit))
+        return lane
+
+    def _expected_wait(self, lane: _Lane) -> float:
+        return lane.avg_service_time * (lane.waiting + 1) / lane.limit
+
+    def _reject(self, lane: _Lane):
+        self.rejected += 1
+        raise SchedulerBusy(max(1, math.ceil(self._expected_wait(lane))))
+
+    def _check_admission(self, lane: _Lane):
+        if lane.active < lane.limit and lane.waiting == 0:
+            return
+        if lane.waiting >= self.max_queue or self._expected_wait(lane) > self.max_wait:
+            self._reject(lane)
+
+    def check_admission(self, model: str):
+        """Fail fast with ``SchedulerBusy`` if a new request for ``model`` would be rejected."""
+        self._check_admission(self._lane(model))
+
+    def _record_wait(self, waited: float):
+        self.admitted += 1
+        self.total_wait += waited
+        self.max_observed_wait = max(self.max_observed_wait, waited)
+
+    async def _acquire(self, lane: _Lane, user_key: str):
+        self._check_admission(lane)
+        if lane.active < lane.limit and lane.waiting == 0:
+            lane.active += 1
+            self._record_wait(0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        lane.queues.setdefault(user_key, deque()).append(future)
+        lane.waiting += 1
+        enqueued_at = time.monotonic()
+        try:
+            done, _ = await asyncio.wait({future}, timeout=self.max_wait)
+        except asyncio.CancelledError:
+            self._abandon(lane, user_key, future)
+            raise
+        if not done:
+            self._abandon(lane, user_key, future)
+            self._reject(lane)
+        self._record_wait(time.monotonic() - enqueued_at)
+
+    def _abandon(self, lane: _Lane, user_key: str, future: asyncio.Future):
+        if future.done():
+            # The slot was handed over while we were giving up on it.
+            self._release(lane)
+            return
+        future.cancel()
+        queue = lane.queues.get(user_key)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            lane.waiting -= 1
+            if not queue:
+                del lane.queues[user_key]
+
+    def _release(self, lane: _Lane):
+        lane.active -= 1
+        while lane.active < lane.limit and lane.queues:
+            user_key, queue = next(iter(lane.queues.items()))
+            future = queue.popleft()
+            lane.waiting -= 1
+            if queue:
+                lane.queues.move_to_end(user_key)
+            else:
+                del lane.queues[user_key]
+            if not future.done():
+                lane.active += 1
+                future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, model: str, user_key: str):
+        lane = self._lane(model)
+        await self._acquire(lane, user_key)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            # Exponential moving average of how long a generation holds a slot.
+            lane.avg_service_time = 0.8 * lane.avg_service_time + 0.2 * (time.monotonic() - started)
+            self._release(lane)
+
+    def stats(self) -> dict:
+        return {
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_wait": self.total_wait / self.admitted if self.admitted else 0.0,
+            "max_wait": self.max_observed_wait,
+            "models": {
+                model: {
+                    "limit": lane.limit,
+                    "active": lane.active,
+                    "queue_depth": lane.waiting,
+                    "waiting_users": len(lane.queues),
+                    "avg_service_time": lane.avg_service_time,
+                }
+                for model, lane in self._lanes.items()
+            },
+        }
+
+
+scheduler = GenerationScheduler(
+    default_limit=settings.GENERATION_CONCURRENCY,
+    model_limits=settings.MODEL_CONCURRENCY,
+    max_queue=settings.GENERATION_QUEUE_SIZE,
+    max_wait=settings.GENERATION_MAX_WAIT,
+)
+
+
+async def scheduled_generate(user_key: str, model: str, prompt: str, **options) -> dict:
+    async with scheduler.slot(model, user_key):
+        data = await llm_client.generate(model, prompt, **options)
+    usage_accountant.record(user_key, model, data)
+    return data
+
+
+async def scheduled_stream(user_key: str, model: str, prompt: str, **options):
+    async with scheduler.slot(model, user_key), \
+            aclosing(llm_client.stream_generate(model, prompt, **options)) as chunks:
+        async for chunk in chunks:
+            if chunk.get("done"):
+                usage_accountant.record(user_key, model, chunk)
+            yield chunk
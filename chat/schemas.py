@@ -1,6 +1,15 @@
+from typing import Optional
+
 from pydantic import BaseModel
 
 class Query(BaseModel):
     prompt: str
     model: str = "llama3.2"
     stream: bool = False
+    # Ollama sampling options, e.g. {"temperature": 0.2, "seed": 42}
+    options: Optional[dict] = None
+    # Set to false for non-deterministic sampling on the stateless endpoints
+    cache: bool = True
+
+    def llm_options(self) -> dict:
+        return {"options": self.options} if self.options else {}
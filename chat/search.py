@@ -0,0 +1,212 @@
+import math
+import re
+from collections import defaultdict
+
+from sqlalchemy import func, literal_column
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from models.Conversation import Conversation as ConvModel
+from models.Message import Message as MsgModel
+
+# Must match the expression of the ix_messages_content_fts GIN index created
+# by the migration, or Postgres won't use the index.
+TS_CONFIG = literal_column("'simple'")
+MESSAGE_TSVECTOR = func.to_tsvector(TS_CONFIG, func.coalesce(MsgModel.content, literal_column("''")))
+
+SNIPPET_WORDS = 12
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> list:
+    return _TOKEN.findall(text.lower())
+
+
+def make_snippet(content: str, terms: set) -> str:
+    """A window of words around the first match, with matches in <b> tags."""
+    words = content.split()
+    for i, word in enumerate(words):
+        if set(tokenize(word)) & terms:
+            start = max(0, i - SNIPPET_WORDS // 2)
+            break
+    else:
+        start = 0
+    window = words[start:start + SNIPPET_WORDS]
+    marked = [f"<b>{word}</b>" if set(tokenize(word)) & terms else word for word in window]
+    prefix = "... " if start > 0 else ""
+    suffix = " ..." if start + SNIPPET_WORDS < len(words) else ""
+    return prefix + " ".join(marked) + suffix
+
+
+class InvertedIndex:
+    """In-process full-text index used when the database has no tsvector support.
+
+    Postings are built per user on their first search and then kept up to date
+    as messages are stored. It is per process, which is fine for SQLite and
+    tests but not for a multi-worker deployment.
+    """
+
+    def __init__(self):
+        # user id -> term -> message id -> term frequency
+        self._postings = {}
+        # user id -> message id -> conversation id
+        self._messages = {}
+
+    @staticmethod
+    def _add(postings: dict, messages: dict, conv_id: str, msg_id: int, content: str):
+        messages[msg_id] = conv_id
+        for term in tokenize(content or ""):
+            postings[term][msg_id] = postings[term].get(msg_id, 0) + 1
+
+    async def _ensure_loaded(self, db: AsyncSession, user_id: str):
+        if user_id in self._postings:
+            return
+        postings, messages = defaultdict(dict), {}
+        result = await db.stream(
+            select(MsgModel.id, MsgModel.conversation_id, MsgModel.content)
+            .join(ConvModel, ConvModel.id == MsgModel.conversation_id)
+            .where(ConvModel.user_id == user_id)
+            .execution_options(yield_per=1000)
+        )
+        async for msg_id, conv_id, content in result:
+            self._add(postings, messages, conv_id, msg_id, content)
+        # Publish only a complete index; another search may have built it meanwhile.
+        self._postings.setdefault(user_id, postings)
+        self._messages.setdefault(user_id, messages)
+
+    def add_messages(self, user_id: str, conv_id: str, messages: list):
+        """Index ``(id, content)`` pairs; a no-op until the user's index is built."""
+        if user_id not in self._postings:
+            return
+        for msg_id, content in messages:
+            self._add(self._postings[user_id], self._messages[user_id], conv_id, msg_id, content)
+
+    def forget_user(self, user_id: str):
+        self._postings.pop(user_id, None)
+        self._messages.pop(user_id, None)
+
+    async def search(self, db: AsyncSession, user_id: str, query: str) -> list:
+        """Rank the user's conversations by the best tf-idf score of a message matching every term."""
+        await self._ensure_loaded(db, user_id)
+        terms = set(tokenize(query))
+        postings = self._postings[user_id]
+        if not terms or any(term not in postings for term in terms):
+            return []
+        total = len(self._messages[user_id])
+        lists = sorted((postings[term] for term in terms), key=len)
+        matching = set(lists[0]).intersection(*lists[1:])
+
+        by_conversation = {}
+        for msg_id in matching:
+            score = sum(
+                postings[term][msg_id] * math.log(1 + total / len(postings[term]))
+                for term in terms
+            )
+            conv_id = self._messages[user_id][msg_id]
+            best = by_conversation.get(conv_id)
+            if best is None:
+                by_conversation[conv_id] = [score, 1, msg_id]
+            else:
+                best[1] += 1
+                if score > best[0]:
+                    best[0], best[2] = score, msg_id
+        ranked = sorted(by_conversation.items(), key=lambda item: (-item[1][0], item[0]))
+        return [(conv_id, score, matches, msg_id) for conv_id, (score, matches, msg_id) in ranked]
+
+
+inverted_index = InvertedIndex()
+
+
+def has_fulltext(db: AsyncSession) -> bool:
+    return db.bind.dialect.name == "postgresql"
+
+
+def index_messages(db: AsyncSession, user_id: str, conv_id: str, messages: list):
+    """Keep the fallback index current; Postgres maintains its GIN index itself."""
+    if not has_fulltext(db):
+        inverted_index.add_messages(user_id, conv_id, messages)
+
+
+async def _search_postgres(db: AsyncSession, user_id: str, query: str, limit: int, offset: int):
+    tsquery = func.websearch_to_tsquery(TS_CONFIG, query)
+    rank = func.ts_rank(MESSAGE_TSVECTOR, tsquery)
+    matches = (
+        select(
+            MsgModel.conversation_id.label("conversation_id"),
+            MsgModel.id.label("message_id"),
+            rank.label("rank"),
+            func.row_number().over(
+                partition_by=MsgModel.conversation_id,
+                order_by=(rank.desc(), MsgModel.id.desc()),
+            ).label("position"),
+            func.count().over(partition_by=MsgModel.conversation_id).label("matches"),
+        )
+        .join(ConvModel, ConvModel.id == MsgModel.conversation_id)
+        .where(ConvModel.user_id == user_id, MESSAGE_TSVECTOR.op("@@")(tsquery))
+        .subquery()
+    )
+    result = await db.execute(
+        select(
+            ConvModel.id,
+            ConvModel.conversation_name,
+            matches.c.rank,
+            matches.c.matches,
+            matches.c.message_id,
+            func.ts_headline(
+                TS_CONFIG, MsgModel.content, tsquery,
+                literal_column("'MaxWords=20, MinWords=8, MaxFragments=1'"),
+            ),
+        )
+        .join(ConvModel, ConvModel.id == matches.c.conversation_id)
+        .join(MsgModel, MsgModel.id == matches.c.message_id)
+        .where(matches.c.position == 1)
+        .order_by(matches.c.rank.desc(), ConvModel.id)
+        .limit(limit + 1)
+        .offset(offset)
+    )
+    return [
+        {
+            "id": conv_id,
+            "conversation_name": name,
+            "rank": rank_value,
+            "matches": match_count,
+            "message_id": message_id,
+            "snippet": snippet,
+        }
+        for conv_id, name, rank_value, match_count, message_id, snippet in result.all()
+    ]
+
+
+async def _search_fallback(db: AsyncSession, user_id: str, query: str, limit: int, offset: int):
+    ranked = (await inverted_index.search(db, user_id, query))[offset:offset + limit + 1]
+    if not ranked:
+        return []
+    names = dict((await db.execute(
+        select(ConvModel.id, ConvModel.conversation_name)
+        .where(ConvModel.id.in_([conv_id for conv_id, _, _, _ in ranked]))
+    )).all())
+    contents = dict((await db.execute(
+        select(MsgModel.id, MsgModel.content)
+        .where(MsgModel.id.in_([msg_id for _, _, _, msg_id in ranked]))
+    )).all())
+    terms = set(tokenize(query))
+    return [
+        {
+            "id": conv_id,
+            "conversation_name": names.get(conv_id),
+            "rank": score,
+            "matches": matches,
+            "message_id": msg_id,
+            "snippet": make_snippet(contents.get(msg_id) or "", terms),
+        }
+        for conv_id, score, matches, msg_id in ranked
+    ]
+
+
+async def search_conversations(db: AsyncSession, user_id: str, query: str, limit: int, offset: int):
+    """Return ``(results, has_more)`` for the user's conversations matching ``query``."""
+    if has_fulltext(db):
+        results = await _search_postgres(db, user_id, query, limit, offset)
+    else:
+        results = await _search_fallback(db, user_id, query, limit, offset)
+    return results[:limit], len(results) > limit
@@ -0,0 +1,62 @@
+import logging
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+import anyio
+import orjson
+
+from chat.llm_client import LLMError
+from chat.scheduler import SchedulerBusy
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def ndjson(event: dict) -> bytes:
+    return orjson.dumps(event, option=orjson.OPT_APPEND_NEWLINE)
+
+
+async def relay_tokens(
+        chunks: AsyncIterator[dict],
+        on_finish: Optional[Callable[[str, Optional[dict]], Awaitable[None]]] = None,
+):
+    """Relay Ollama stream chunks to the client as NDJSON events.
+
+    Emits ``{"token": ...}`` per chunk and a final ``{"done": true, ...}`` event
+    carrying time-to-first-token. ``on_finish`` receives the assembled text and
+    Ollama's final chunk (``None`` if the generation did not complete); it also
+    runs when the client disconnects.
+    """
+    started = time.perf_counter()
+    time_to_first_token = None
+    parts = []
+    final = None
+    try:
+        async for chunk in chunks:
+            token = chunk.get("response", "")
+            if token:
+                if time_to_first_token is None:
+                    time_to_first_token = time.perf_counter() - started
+                    logging.info(f"Time to first token: {time_to_first_token:.3f}s")
+                parts.append(token)
+                yield ndjson({"token": token})
+            if chunk.get("done"):
+                final = chunk
+                yield ndjson({
+                    "done": True,
+                    "time_to_first_token": time_to_first_token,
+                    "total_time": time.perf_counter() - started,
+                    "eval_count": chunk.get("eval_count"),
+                })
+    except SchedulerBusy as e:
+        yield ndjson({"error": str(e), "retry_after": e.retry_after})
+    except LLMError as e:
+        logging.error(f"Error during streamed generation: {e}")
+        yield ndjson({"error": str(e)})
+    finally:
+        # The response task is cancelled on disconnect; shield the cleanup.
+        with anyio.CancelScope(shield=True):
+            # Close the upstream stream now rather than on garbage collection,
+            # so an abandoned generation stops right away.
+            await chunks.aclose()
+            if on_finish is not None:
+                await on_finish("".join(parts), final)
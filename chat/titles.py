@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import re
+
+import settings
+from chat import repository
+from chat.llm_client import LLMError
+from chat.scheduler import scheduled_generate, SchedulerBusy
+from database import AsyncSessionLocal
+
+
+def title_prompt(message: str) -> str:
+    return f"""You are a helpful assistant whose only job is to create concise chat titles. 
+Given the very first user message, generate a title in exactly 3–5 words that captures its specific topic—nothing generic or off-topic.
+
+Examples:
+User message: "How to make pull ups?"
+Title: "How to Do Pull-Ups"
+
+User message: "Tips for installing Python packages on Windows"
+Title: "Installing Python Packages on Windows"
+
+User message: "What’s the best way to learn guitar chords?"
+Title: "Learning Guitar Chords Effectively"
+
+User message: "How can I improve my sleep schedule?"
+Title: "Improving Your Sleep Schedule"
+
+---
+User message: "{message}"
+Title:"""
+
+
+def clean_title(text: str) -> str:
+    """Strip the quotes, labels and extra lines models like to add around a title."""
+    lines = text.strip().splitlines()
+    title = lines[0] if lines else ""
+    title = re.sub(r"^\s*title\s*:\s*", "", title, flags=re.IGNORECASE)
+    title = title.strip().strip("\"'“”*").strip()
+    return title[:settings.TITLE_MAX_CHARS].rstrip()
+
+
+def fallback_title(message: str) -> str:
+    """Cheap title from the first words of the message."""
+    words = re.findall(r"\w[\w'-]*", message)[:5]
+    title = " ".join(words).capitalize() if words else "New Chat"
+    return title[:settings.TITLE_MAX_CHARS].rstrip()
+
+
+async def generate_title(conv_id: str, first_message: str, current_name: str):
+    """Name a conversation after its first message.
+
+    Runs as a background task once the first reply is stored. Uses the small
+    title model with a timeout and falls back to a heuristic title, and never
+    overwrites a name the user set in the meantime.
+    """
+    title = ""
+    try:
+        data = await asyncio.wait_for(
+            scheduled_generate("system:titles", settings.TITLE_MODEL, title_prompt(first_message)),
+            timeout=settings.TITLE_TIMEOUT,
+        )
+        title = clean_title(data["response"])
+    except (asyncio.TimeoutError, LLMError, SchedulerBusy) as e:
+        logging.warning(f"Title generation for conversation {conv_id} failed, using fallback: {e!r}")
+    if not title:
+        title = fallback_title(first_message)
+
+    try:
+        async with AsyncSessionLocal() as db:
+            await repository.set_generated_title(db, conv_id, title, current_name)
+    except Exception as e:
+        logging.error(f"Error saving title for conversation {conv_id}: {e}")
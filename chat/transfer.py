@@ -0,0 +1,204 @@
+from typing import AsyncIterator, Optional
+
+import orjson
+from sqlalchemy import bindparam, func, insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+import settings
+from chat.repository import upsert_insert, preview
+from chat.streaming import ndjson
+from database import ReadSessionLocal
+from models.Conversation import Conversation as ConvModel
+from models.Message import Message as MsgModel
+
+ROLES = ("user", "model")
+
+
+class ImportFormatError(ValueError):
+    def __init__(self, line: int, message: str):
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+        # Counts of what was committed before the error
+        self.imported = {}
+
+
+async def export_conversations(user_id: str, conv_id: Optional[str] = None) -> AsyncIterator[bytes]:
+    """Stream the user's conversations as NDJSON.
+
+    Each conversation is a ``{"type": "conversation", ...}`` line followed by
+    its ``{"type": "message", ...}`` lines in order. Rows come from a
+    server-side cursor in batches of ``EXPORT_BATCH_SIZE``, so memory stays
+    flat however large the account is. The generator opens its own session
+    because the request's session is closed before the body is streamed.
+    """
+    statement = (
+        select(ConvModel.id, ConvModel.conversation_name, MsgModel.role, MsgModel.content)
+        .outerjoin(MsgModel, MsgModel.conversation_id == ConvModel.id)
+        .where(ConvModel.user_id == user_id)
+        .order_by(ConvModel.id, MsgModel.id)
+        .execution_options(yield_per=settings.EXPORT_BATCH_SIZE)
+    )
+    if conv_id is not None:
+        statement = statement.where(ConvModel.id == conv_id)
+
+    async with ReadSessionLocal() as session:
+        result = await session.stream(statement)
+        current = None
+        async for partition in result.partitions():
+            lines = []
+            for row_conv_id, name, role, content in partition:
+                if row_conv_id != current:
+                    current = row_conv_id
+                    lines.append(ndjson({"type": "conversation", "id": row_conv_id, "conversation_name": name}))
+                if role is not None:
+                    lines.append(ndjson({
+                        "type": "message", "conversation_id": row_conv_id, "role": role, "content": content,
+                    }))
+            yield b"".join(lines)
+
+
+async def _ndjson_records(body: AsyncIterator[bytes]):
+    """Yield ``(line_number, record)`` from a chunked NDJSON body."""
+    buffer = b""
+    line_number = 0
+    async for chunk in body:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        if len(buffer) > settings.IMPORT_MAX_LINE_BYTES:
+            raise ImportFormatError(line_number + len(lines) + 1, "line too long")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, _parse(line_number, line)
+    if buffer.strip():
+        yield line_number + 1, _parse(line_number + 1, buffer)
+
+
+def _parse(line_number: int, line: bytes) -> dict:
+    try:
+        record = orjson.loads(line)
+    except ValueError:
+        raise ImportFormatError(line_number, "invalid JSON")
+    if not isinstance(record, dict):
+        raise ImportFormatError(line_number, "expected an object")
+    return record
+
+
+class _Importer:
+    """Buffers parsed records and writes them as multi-row inserts."""
+
+    def __init__(self, db: AsyncSession, user_id: str):
+        self.db = db
+        self.user_id = user_id
+        self.conversations = []
+        self.messages = []
+        # conversation id -> whether it is imported (False: id was taken)
+        self.declared = {}
+        self.imported_conversations = 0
+        self.imported_messages = 0
+        self.skipped_conversations = 0
+
+    def add(self, line_number: int, record: dict):
+        kind = record.get("type")
+        if kind == "conversation":
+            conv_id = record.get("id")
+            if not isinstance(conv_id, str) or not conv_id:
+                raise ImportFormatError(line_number, "conversation needs a string id")
+            if conv_id in self.declared:
+                raise ImportFormatError(line_number, f"duplicate conversation {conv_id}")
+            self.declared[conv_id] = True
+            name = record.get("conversation_name")
+            self.conversations.append({
+                "id": conv_id,
+                "conversation_name": name if isinstance(name, str) else "New Chat",
+                "user_id": self.user_id,
+            })
+        elif kind == "message":
+            conv_id = record.get("conversation_id")
+            if conv_id not in self.declared:
+                raise ImportFormatError(line_number, "message before its conversation")
+            if record.get("role") not in ROLES or not isinstance(record.get("content"), str):
+                raise ImportFormatError(line_number, f"message needs a role in {ROLES} and string content")
+            self.messages.append({"conversation_id": conv_id, "role": record["role"], "content": record["content"]})
+        else:
+            raise ImportFormatError(line_number, f"unknown record type {kind!r}")
+
+    def summary(self) -> dict:
+        return {
+            "conversations": self.imported_conversations,
+            "messages": self.imported_messages,
+            "skipped_conversations": self.skipped_conversations,
+        }
+
+    @property
+    def pending(self) -> int:
+        return len(self.conversations) + len(self.messages)
+
+    async def _update_activity(self, messages: list):
+        # Keep the list columns (count, preview, last activity) in step, one
+        # executemany for all conversations of the batch.
+        activity = {}
+        for row in messages:
+            count, _ = activity.get(row["conversation_id"], (0, None))
+            activity[row["conversation_id"]] = (count + 1, row["content"])
+        table = ConvModel.__table__
+        await self.db.execute(
+            update(table)
+            .where(table.c.id == bindparam("conv_id"))
+            .values(
+                message_count=table.c.message_count + bindparam("added"),
+                last_message_preview=bindparam("last_preview"),
+                updated_at=func.now(),
+            ),
+            [
+                {"conv_id": conv_id, "added": count, "last_preview": preview(content)}
+                for conv_id, (count, content) in activity.items()
+            ],
+        )
+
+    async def flush(self):
+        if self.conversations:
+            # Ids already in use (by anyone) are skipped together with their messages.
+            result = await self.db.execute(
+                upsert_insert(self.db, ConvModel)
+                .values(self.conversations)
+                .on_conflict_do_nothing(index_elements=[ConvModel.id])
+                .returning(ConvModel.id)
+            )
+            inserted = set(result.scalars().all())
+            for row in self.conversations:
+                if row["id"] not in inserted:
+                    self.declared[row["id"]] = False
+            self.imported_conversations += len(inserted)
+            self.skipped_conversations += len(self.conversations) - len(inserted)
+            self.conversations = []
+        messages = [row for row in self.messages if self.declared[row["conversation_id"]]]
+        if messages:
+            await self.db.execute(insert(MsgModel), messages)
+            self.imported_messages += len(messages)
+            await self._update_activity(messages)
+        self.messages = []
+        await self.db.commit()
+
+
+async def import_conversations(db: AsyncSession, user_id: str, body: AsyncIterator[bytes]) -> dict:
+    """Import an NDJSON export into the user's account.
+
+    The body is parsed as it arrives and written in batches of
+    ``IMPORT_BATCH_SIZE`` rows, each batch in its own transaction, so large
+    imports neither buffer the whole file nor hold one long transaction.
+    Conversations whose id already exists are skipped. On a malformed line
+    ``ImportFormatError`` is raised; batches before it stay imported.
+    """
+    importer = _Importer(db, user_id)
+    try:
+        async for line_number, record in _ndjson_records(body):
+            importer.add(line_number, record)
+            if importer.pending >= settings.IMPORT_BATCH_SIZE:
+                await importer.flush()
+    except ImportFormatError as e:
+        e.imported = importer.summary()
+        raise
+    await importer.flush()
+    return importer.summary()
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+from datetime import date, datetime, timezone
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+import settings
+from chat.repository import upsert_insert
+from database import AsyncSessionLocal
+from models.Usage import Usage as UsageModel
+from monitoring.metrics import LLM_TOKENS_USED
+
+COUNTERS = ("requests", "prompt_tokens", "completion_tokens")
+
+
+def today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+class UsageAccountant:
+    """Token usage per user, model and (UTC) day.
+
+    Generations are counted in memory from the ``prompt_eval_count`` and
+    ``eval_count`` Ollama reports, and written to the usage table every
+    ``flush_interval`` seconds as one batched upsert, so the request path never
+    waits on the database. Counts of a failed flush are kept for the next one.
+    """
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        # (user_key, day, model) -> [requests, prompt_tokens, completion_tokens]
+        self._pending: dict = {}
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.failed_flushes = 0
+
+    def record(self, user_key: str, model: str, data: Optional[dict]):
+        """Count a completed generation from Ollama's final response (or chunk)."""
+        if not data:
+            return
+        prompt_tokens = data.get("prompt_eval_count") or 0
+        completion_tokens = data.get("eval_count") or 0
+        counts = self._pending.setdefault((user_key, today(), model), [0, 0, 0])
+        counts[0] += 1
+        counts[1] += prompt_tokens
+        counts[2] += completion_tokens
+        LLM_TOKENS_USED.labels(model, "prompt").inc(prompt_tokens)
+        LLM_TOKENS_USED.labels(model, "completion").inc(completion_tokens)
+
+    def _merge(self, pending: dict):
+        for key, counts in pending.items():
+            current = self._pending.setdefault(key, [0, 0, 0])
+            for i, value in enumerate(counts):
+                current[i] += value
+
+    async def flush(self) -> int:
+        """Write the pending counts; returns the number of rows upserted."""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        rows = [
+            {"user_key": user_key, "day": day, "model": model, **dict(zip(COUNTERS, counts))}
+            for (user_key, day, model), counts in pending.items()
+        ]
+        committed = False
+        try:
+            async with AsyncSessionLocal() as db:
+                stmt = upsert_insert(db, UsageModel)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[UsageModel.user_key, UsageModel.day, UsageModel.model],
+                    set_={name: getattr(UsageModel, name) + getattr(stmt.excluded, name) for name in COUNTERS},
+                )
+                await db.execute(stmt, rows)
+                await db.commit()
+                committed = True
+        except Exception as e:
+            self.failed_flushes += 1
+            logging.error(f"Error flushing token usage, keeping {len(rows)} rows for the next flush: {e}")
+            return 0
+        finally:
+            if not committed:
+                self._merge(pending)
+        self.flushes += 1
+        return len(rows)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def usage(self, db: AsyncSession, user_key: str, since: date) -> list:
+        """Daily usage of ``user_key`` per model since ``since``, newest day first.
+
+        Includes counts not flushed yet.
+        """
+        result = await db.execute(
+            select(UsageModel.day, UsageModel.model, *(getattr(UsageModel, name) for name in COUNTERS))
+            .where(UsageModel.user_key == user_key, UsageModel.day >= since)
+        )
+        totals = {(day, model): list(counts) for day, model, *counts in result.all()}
+        for (key_user, day, model), counts in self._pending.items():
+            if key_user == user_key and day >= since:
+                current = totals.setdefault((day, model), [0, 0, 0])
+                for i, value in enumerate(counts):
+                    current[i] += value
+        return [
+            {"day": day.isoformat(), "model": model, **dict(zip(COUNTERS, counts))}
+            for (day, model), counts in sorted(totals.items(), reverse=True)
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "pending_rows": len(self._pending),
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+        }
+
+
+usage_accountant = UsageAccountant(flush_interval=settings.USAGE_FLUSH_INTERVAL)
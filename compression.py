@@ -0,0 +1,109 @@
+import gzip
+from typing import Optional
+
+import anyio
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+
+import settings
+
+# Streams are flushed event by event; buffering them to compress would
+# defeat the streaming, so they go out as they are.
+UNCOMPRESSED_TYPES = ("application/x-ndjson", "text/event-stream")
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+# Bodies above this size are compressed in a worker thread
+THREAD_MIN_SIZE = 256 * 1024
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """The best of ``br`` and ``gzip`` the client accepts, or ``None``."""
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip()] = quality
+    wildcard = accepted.get("*", 0.0)
+    for coding in ("br", "gzip"):
+        if accepted.get(coding, wildcard) > 0:
+            return coding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=settings.BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=settings.GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """Compress complete JSON/text responses above a size threshold.
+
+    The encoding is negotiated from ``Accept-Encoding`` (brotli preferred over
+    gzip). Streamed bodies (NDJSON, event streams, anything sent in several
+    chunks) pass through untouched. Strong ETags are weakened on compressed
+    responses since the bytes differ from the identity representation.
+    """
+
+    def __init__(self, app, minimum_size: int = settings.COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                if (
+                        "content-encoding" in headers
+                        or content_type.startswith(UNCOMPRESSED_TYPES)
+                        or not content_type.startswith(COMPRESSIBLE_TYPES)
+                ):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message
+                return
+
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            if message.get("more_body", False) or len(body) < self.minimum_size:
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            if len(body) >= THREAD_MIN_SIZE:
+                body = await anyio.to_thread.run_sync(compress, body, encoding)
+            else:
+                body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            etag = headers.get("etag")
+            if etag and etag.startswith('"'):
+                headers["ETag"] = f"W/{etag}"
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_wrapper)
@@ -1,6 +1,8 @@
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
+import settings
+from authentication.principal_cache import Principal, principal_cache
 from models.User import User
 from database import get_db
 from sqlalchemy.future import select
@@ -12,18 +14,29 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 async def get_current_user(
         token: str = Depends(oauth2_scheme),
         db=Depends(get_db)
-):
+) -> Principal:
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
 
-        result = await db.execute(select(User).filter_by(id=user_id))
-        user = result.scalars().first()
+        result = await db.execute(select(User.id, User.username).filter_by(id=user_id))
+        user = result.first()
 
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
-        return user
+        principal = Principal(id=user.id, username=user.username)
+        principal_cache.put(token, principal, payload.get("exp"))
+        return principal
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+
+
+async def get_admin_user(current_user: Principal = Depends(get_current_user)) -> Principal:
+    if current_user.username not in settings.ADMIN_USERNAMES:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
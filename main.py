@@ -1,184 +1,369 @@
-import json
+import hashlib
 import logging
 import os
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from typing import Optional
 
-from fastapi import FastAPI, HTTPException, Depends
+import orjson
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Request, Response, Query as QueryParam
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
-import requests
+from starlette.background import BackgroundTask
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+import settings
+from chat import repository
+from chat import search
+from chat.cancellation import (
+    CancellableStreamingResponse, Generation, GenerationCancelled, REQUEST_ID_HEADER, request_id, run_cancellable,
+)
+from chat.context import build_prompt, update_summary, context_values, estimate_tokens
+from chat.llm_client import llm_client
+from chat.ratelimit import rate_limiter
+from chat.recall import recall
+from chat.scheduler import scheduler, scheduled_generate, scheduled_stream, SchedulerBusy, too_many_requests
 from chat.schemas import Query
-from database import get_db, engine
+from chat.streaming import relay_tokens, NDJSON_MEDIA_TYPE
+from chat.titles import generate_title
+from chat.transfer import export_conversations, import_conversations, ImportFormatError
+from chat.usage import usage_accountant, today
+from compression import CompressionMiddleware
+from database import get_db, get_read_db, AsyncSessionLocal, check_schema, engine, read_engine
 
 from models.Conversation import Conversation as ConvModel
-from models.Message import Message as MsgModel
-from models.User import User
-
-from models.Base import Base
+from authentication.principal_cache import Principal
 
 from authentication.routes import router as auth_router
 from chat.routes import router as gen_router
+from monitoring.metrics import MetricsMiddleware, instrument_engine
+from monitoring.routes import router as monitoring_router, metrics_router, admin_router
 from dependencies import get_current_user
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Схема создаётся миграциями Alembic, здесь только проверяем её
+    if settings.SCHEMA_CHECK != "off":
+        diffs = await check_schema()
+        if diffs:
+            logging.error(f"Database schema does not match the models, run 'alembic upgrade head': {diffs}")
+            if settings.SCHEMA_CHECK == "strict":
+                raise RuntimeError("Database schema is out of date")
+    await llm_client.start()
+    usage_accountant.start()
+    yield
+    await usage_accountant.close()
+    await llm_client.close()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
 app.include_router(auth_router)
 app.include_router(gen_router)
+app.include_router(monitoring_router)
+app.include_router(metrics_router)
+app.include_router(admin_router)
+
+instrument_engine(engine)
+if read_engine is not engine:
+    instrument_engine(read_engine)
+
 
 
 
 
+def _etag(body) -> str:
+    digest = hashlib.blake2b(orjson.dumps(body, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+    return f'"{digest}"'
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = {value.strip().removeprefix("W/") for value in header.split(",")}
+    return etag in candidates or "*" in candidates
 
 @app.get("/conversation/list")
 async def list_conversations(
-        current_user: User = Depends(get_current_user),
-        db: AsyncSession = Depends(get_db)
+        request: Request,
+        limit: int = QueryParam(settings.LIST_PAGE_SIZE, ge=1, le=200),
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_read_db)
 ):
-    result = await db.execute(
-        select(ConvModel)
-        .filter_by(user_id=current_user.id)
+    """The user's conversations by last activity, newest first.
+
+    Each entry carries ``updated_at``, ``message_count`` and
+    ``last_message_preview``. Pass ``next_cursor`` back as ``cursor`` for the
+    next page. Responses have an ``ETag``; a matching ``If-None-Match`` gets
+    an empty ``304``.
+    """
+    try:
+        conversations, next_cursor = await repository.list_conversations(db, current_user.id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    body = {"conversations": conversations, "next_cursor": next_cursor}
+    etag = _etag(body)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse(body, headers=headers)
+
+@app.get("/conversation/search")
+async def search_conversations(
+        q: str = QueryParam(..., min_length=1, max_length=200),
+        limit: int = QueryParam(20, ge=1, le=50),
+        offset: int = QueryParam(0, ge=0),
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_read_db)
+):
+    """Find the user's conversations whose messages contain all words of ``q``.
+
+    Results are ranked by their best matching message, which is returned as
+    ``message_id`` with a highlighted ``snippet``.
+    """
+    results, has_more = await search.search_conversations(db, current_user.id, q, limit, offset)
+    return {"results": results, "has_more": has_more}
+
+@app.get("/conversation/export")
+async def export_all_conversations(current_user: Principal = Depends(get_current_user)):
+    """Stream every conversation of the user with its messages as NDJSON."""
+    return StreamingResponse(
+        export_conversations(current_user.id),
+        media_type=NDJSON_MEDIA_TYPE,
+        headers={"Content-Disposition": 'attachment; filename="conversations.ndjson"'},
     )
-    conversations = result.scalars().all()
-    return [
-        {"id": conv.id, "conversation_name": conv.conversation_name}
-        for conv in conversations
-    ]
+
+@app.post("/conversation/import")
+async def import_all_conversations(
+        request: Request,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_db)
+):
+    """Import an NDJSON body in the format produced by the export endpoints."""
+    try:
+        imported = await import_conversations(db, current_user.id, request.stream())
+    except ImportFormatError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail={"error": str(e), "imported": e.imported})
+    finally:
+        search.inverted_index.forget_user(current_user.id)
+    return imported
+
+@app.get("/usage")
+async def get_usage(
+        days: int = QueryParam(30, ge=1, le=366),
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_read_db)
+):
+    """The user's token usage per day and model over the last ``days`` days (UTC)."""
+    usage = await usage_accountant.usage(db, current_user.id, today() - timedelta(days=days - 1))
+    totals = {name: sum(row[name] for row in usage) for name in ("requests", "prompt_tokens", "completion_tokens")}
+    return {"usage": usage, "totals": totals}
 
 @app.post("/conversation/start")
 async def start_conversation(
         conv_id: str,
         conv_name: str = "New Chat",
-        current_user: User = Depends(get_current_user),
+        current_user: Principal = Depends(get_current_user),
         db: AsyncSession = Depends(get_db)
 ):
-    exists = await db.execute(
-        select(ConvModel)
-        .filter_by(id=conv_id, user_id=current_user.id)
-    )
-    if exists.scalars().first():
+    new_conv = await repository.create_conversation(db, conv_id, conv_name, current_user.id)
+    if not new_conv:
         raise HTTPException(status_code=400, detail="Conversation ID already exists")
-
-    new_conv = ConvModel(
-        id=conv_id,
-        conversation_name=conv_name,
-        user_id=current_user.id
-    )
-    db.add(new_conv)
-    await db.commit()
-    await db.refresh(new_conv)
     return {"id": new_conv.id, "conversation_name": new_conv.conversation_name}
 
 @app.post("/conversation/{conv_id}/rename")
 async def rename_conversation(
         conv_id: str,
         conv_name: str,
-        current_user: User = Depends(get_current_user),
+        current_user: Principal = Depends(get_current_user),
         db: AsyncSession = Depends(get_db)
 ):
-    result = await db.execute(
-        select(ConvModel).filter_by(id=conv_id, user_id=current_user.id)
-    )
-    conv = result.scalars().first()
+    conv = await repository.rename_conversation(db, conv_id, current_user.id, conv_name)
     if not conv:
         raise HTTPException(status_code=404, detail="Conversation not found")
-    conv.conversation_name = conv_name
-    await db.commit()
-    await db.refresh(conv)
     return {"id": conv.id, "conversation_name": conv.conversation_name}
 
 @app.get("/conversation/{conv_id}")
 async def get_conversation(
         conv_id: str,
-        current_user: User = Depends(get_current_user),
-        db: AsyncSession = Depends(get_db)
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+        limit: int = QueryParam(100, ge=1, le=1000),
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_read_db)
 ):
-    result = await db.execute(
-        select(ConvModel).filter_by(id=conv_id, user_id=current_user.id)
+    """Page through a conversation's messages in chronological (id) order.
+
+    Without cursors the newest ``limit`` messages are returned. ``before`` pages
+    backwards from a message id; ``after`` returns only messages newer than the
+    given id, so clients can fetch just what they don't have yet. ``has_more``
+    tells whether further messages exist in the paging direction.
+    """
+    conv, messages, has_more = await repository.get_history_page(
+        db, conv_id, current_user.id, before, after, limit
     )
-    conv = result.scalars().first()
     if not conv:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
-    msg_res = await db.execute(select(MsgModel).filter_by(conversation_id=conv_id))
-    msgs = msg_res.scalars().all()
-
-    messages = [
-        {"role": msg.role, "content": msg.content}
-        for msg in msgs
-    ]
-    return {
+    # Plain rows straight to orjson; skips FastAPI's jsonable_encoder pass.
+    return ORJSONResponse({
         "id": conv.id,
         "conversation_name": conv.conversation_name,
-        "messages": messages
-    }
+        "messages": messages,
+        "has_more": has_more
+    })
+
+
+@app.get("/conversation/{conv_id}/export")
+async def export_conversation(
+        conv_id: str,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_read_db)
+):
+    """Stream one conversation with its messages as NDJSON."""
+    result = await db.execute(
+        select(ConvModel.id).where(ConvModel.id == conv_id, ConvModel.user_id == current_user.id)
+    )
+    if result.first() is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return StreamingResponse(
+        export_conversations(current_user.id, conv_id),
+        media_type=NDJSON_MEDIA_TYPE,
+        headers={"Content-Disposition": f'attachment; filename="{conv_id}.ndjson"'},
+    )
 
 
 @app.post("/conversation/{conv_id}/message")
 async def add_message(
         conv_id: str,
         query: Query,
-        current_user: User = Depends(get_current_user),
+        request: Request,
+        response: Response,
+        background_tasks: BackgroundTasks,
+        current_user: Principal = Depends(get_current_user),
         db: AsyncSession = Depends(get_db)
 ):
-    result = await db.execute(
-        select(ConvModel).filter_by(id=conv_id, user_id=current_user.id)
+    """Generate a reply and store the turn.
+
+    The generation is aborted as soon as the client disconnects or calls
+    ``POST /generation/cancel/{request_id}`` with the ``X-Request-ID`` of this
+    request (sent by the client or returned in the response headers); a
+    cancelled turn is not stored.
+    """
+    await rate_limiter.enforce(current_user.id, "conversation_message")
+    conversation, recent = await repository.get_conversation_for_turn(
+        db, conv_id, current_user.id, settings.CONTEXT_MAX_MESSAGES + 1
     )
-    conversation = result.scalars().first()
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
-    msg_res = await db.execute(select(MsgModel).filter_by(conversation_id=conv_id))
-    msgs = msg_res.scalars().all()
+    context = build_prompt(conversation, recent, query.prompt, query.model)
+    if recall.enabled and "context" not in context.options and (context.truncated or conversation.summary_upto_id):
+        # Part of the history is not in the prompt; bring back the most relevant older turns.
+        before_id = context.window_start_id or (recent[0][0] + 1 if recent else None)
+        if before_id is not None:
+            recalled = await recall.recall(db, conv_id, current_user.id, query.prompt, before_id)
+            if recalled:
+                context = build_prompt(conversation, recent, query.prompt, query.model, recalled)
+    prompt = context.prompt
+    # Follow-up work runs after the response (or the stream) has finished and
+    # only if the turn was stored; a cancelled or failed turn must not spend
+    # generation slots on titles or summaries.
+    follow_ups = BackgroundTasks()
+    if context.truncated:
+        follow_ups.add_task(update_summary, conv_id, query.model, context.window_start_id)
+    if not recent and not conversation.summary_upto_id:
+        follow_ups.add_task(generate_title, conv_id, query.prompt, conversation.conversation_name)
+    if recall.enabled:
+        follow_ups.add_task(recall.embed_messages, conv_id)
 
-    conversation_history = ""
-    for message in msgs:
-        conversation_history += (f"{message.role} "
-                   f": {message.content}\n")
+    generation = Generation(request_id(request), current_user.id, query.model)
+    if query.stream:
+        try:
+            scheduler.check_admission(query.model)
+        except SchedulerBusy as e:
+            raise too_many_requests(e)
 
-    user_msg = MsgModel(
-        role="user",
-        content=query.prompt,
-        conversation_id=conv_id
-    )
-    db.add(user_msg)
-    await db.flush()
+        stored = False
 
-    prompt = f"Conversation history:\n{conversation_history}\nuser: {query.prompt}\nassistant:"
+        async def save_reply(generated_text: str, final: Optional[dict]):
+            nonlocal stored
+            # The request session is already closed once the body streams,
+            # so the turn is stored with its own session.
+            if generation.cancelled:
+                generation.generated_tokens = estimate_tokens(generated_text)
+                logging.info(f"Generation {generation.request_id} cancelled ({generation.reason}), turn not saved")
+                return
+            if not generated_text:
+                return
+            if final is None:
+                logging.warning(f"Stream for conversation {conv_id} aborted, saving partial reply")
+            try:
+                async with AsyncSessionLocal() as session:
+                    prompt_id, reply_id = await repository.save_turn(
+                        session, conv_id, query.prompt, generated_text,
+                        lambda reply_id: context_values(query.model, final, reply_id),
+                    )
+                    search.index_messages(session, current_user.id, conv_id,
+                                          [(prompt_id, query.prompt), (reply_id, generated_text)])
+                stored = True
+            except Exception as e:
+                logging.error(f"Error saving streamed reply: {e}")
 
+        async def run_follow_ups():
+            if stored:
+                await follow_ups()
 
+        return CancellableStreamingResponse(
+            relay_tokens(
+                scheduled_stream(
+                    current_user.id, query.model, prompt,
+                    affinity_key=conv_id, **query.llm_options(), **context.options
+                ),
+                on_finish=save_reply,
+            ),
+            generation,
+            media_type=NDJSON_MEDIA_TYPE,
+            background=BackgroundTask(run_follow_ups),
+        )
+
+    response.headers[REQUEST_ID_HEADER] = generation.request_id
     try:
         logging.info(f"Sending request to external API with prompt: {query.prompt}")
-        response = requests.post(
-            "http://localhost:11434/api/generate",
-            json={"model": query.model, "prompt": prompt, "stream": query.stream},
-        )
-        response.raise_for_status()
-        generated_text = response.json().get("response")
-        if not generated_text:
-            raise ValueError("Missing 'response' in external API response")
-
-        model_msg = MsgModel(
-            role="model",
-            content=generated_text,
-            conversation_id=conv_id
+        data = await run_cancellable(request, generation, lambda: scheduled_generate(
+            current_user.id, query.model, prompt,
+            affinity_key=conv_id, **query.llm_options(), **context.options
+        ))
+        generated_text = data["response"]
+
+        # Both messages are written after generation in one transaction, so a
+        # failed generation leaves nothing behind to roll back.
+        prompt_id, reply_id = await repository.save_turn(
+            db, conv_id, query.prompt, generated_text,
+            lambda reply_id: context_values(query.model, data, reply_id),
         )
-        db.add(model_msg)
-        await db.commit()
+        search.index_messages(db, current_user.id, conv_id,
+                              [(prompt_id, query.prompt), (reply_id, generated_text)])
+        background_tasks.add_task(follow_ups)
 
         return {"generated_text": generated_text}
 
+    except SchedulerBusy as e:
+        raise too_many_requests(e)
+    except GenerationCancelled as e:
+        logging.info(f"Generation {generation.request_id} cancelled ({e.reason}), turn not saved")
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         await db.rollback()
         logging.error(f"Error during chat generation: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.on_event("startup")
-async def on_startup():
-    # Асинхронно создаём схему
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -1,13 +1,28 @@
-from sqlalchemy import Column, String, Integer, ForeignKey, Text
+from sqlalchemy import Column, String, Integer, ForeignKey, Text, JSON, Index, DateTime, func
 from sqlalchemy.orm import relationship
 from models.Base import Base
 
 class Conversation(Base):
     __tablename__ = 'conversations'
+    __table_args__ = (
+        Index('ix_conversations_user_id_id', 'user_id', 'id'),
+        Index('ix_conversations_user_id_updated_at_id', 'user_id', 'updated_at', 'id'),
+    )
 
     id = Column(String, primary_key=True)
     conversation_name = Column(String)
     user_id = Column(String, ForeignKey('users.id'))
+    # Maintained when messages are stored, so the list needs no aggregation
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_message_preview = Column(String)
+    # Rolling summary of every message with id <= summary_upto_id
+    summary = Column(Text)
+    summary_upto_id = Column(Integer, nullable=False, default=0, server_default="0")
+    # Ollama context tokens after the reply with id llm_context_upto_id
+    llm_context = Column(JSON)
+    llm_context_model = Column(String)
+    llm_context_upto_id = Column(Integer)
 
     user = relationship("User", back_populates="conversations")
     messages = relationship("Message", back_populates="conversation")
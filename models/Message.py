@@ -1,9 +1,12 @@
-from sqlalchemy import Column, String, Integer, ForeignKey, Text
+from sqlalchemy import Column, String, Integer, ForeignKey, Text, Index
 from sqlalchemy.orm import relationship
 from models.Base import Base
 
 class Message(Base):
     __tablename__ = 'messages'
+    __table_args__ = (
+        Index('ix_messages_conversation_id_id', 'conversation_id', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     role = Column(String)
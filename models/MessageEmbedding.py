@@ -0,0 +1,15 @@
+from sqlalchemy import Column, String, Integer, ForeignKey, LargeBinary, Index
+from models.Base import Base
+
+class MessageEmbedding(Base):
+    __tablename__ = 'message_embeddings'
+    __table_args__ = (
+        Index('ix_message_embeddings_conversation_id_message_id', 'conversation_id', 'message_id'),
+    )
+
+    message_id = Column(Integer, ForeignKey('messages.id', ondelete='CASCADE'), primary_key=True)
+    conversation_id = Column(String, ForeignKey('conversations.id', ondelete='CASCADE'), nullable=False)
+    # Vectors of different embedding models are not comparable
+    model = Column(String, nullable=False)
+    # float32 array, little-endian, L2-normalized
+    embedding = Column(LargeBinary, nullable=False)
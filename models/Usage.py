@@ -0,0 +1,14 @@
+from sqlalchemy import Column, String, Integer, BigInteger, Date
+from models.Base import Base
+
+class Usage(Base):
+    __tablename__ = 'usage'
+
+    # User id, or "ip:..." / "system:..." for anonymous and internal generations
+    user_key = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    model = Column(String, primary_key=True)
+    requests = Column(Integer, nullable=False, default=0)
+    # Ollama's prompt_eval_count and eval_count, summed
+    prompt_tokens = Column(BigInteger, nullable=False, default=0)
+    completion_tokens = Column(BigInteger, nullable=False, default=0)
@@ -0,0 +1,152 @@
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served", ["method"],
+)
+
+LLM_REQUEST_DURATION = Histogram(
+    "llm_request_duration_seconds", "Upstream LLM generation latency",
+    ["model", "mode"], buckets=LATENCY_BUCKETS,
+)
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds", "Time until the upstream LLM produced the first token",
+    ["model"], buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "llm_tokens_per_second", "Upstream LLM generation speed",
+    ["model"], buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 250),
+)
+LLM_ERRORS = Counter("llm_errors_total", "Failed upstream LLM calls", ["model"])
+LLM_GENERATIONS_CANCELLED = Counter(
+    "llm_generations_cancelled_total", "Generations aborted before completion", ["model", "reason"],
+)
+LLM_TOKENS_SAVED = Counter(
+    "llm_tokens_saved_total", "Estimated tokens not generated thanks to cancellation", ["model"],
+)
+LLM_TOKENS_USED = Counter(
+    "llm_tokens_used_total", "Tokens reported by Ollama for completed generations", ["model", "kind"],
+)
+RATE_LIMITED = Counter(
+    "rate_limited_requests_total", "Requests rejected by the per-user rate limit", ["endpoint"],
+)
+
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Database statement latency", buckets=DB_BUCKETS,
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request", "Database statements executed per HTTP request",
+    ["route"], buckets=(0, 1, 2, 3, 4, 5, 8, 12, 20, 50),
+)
+DB_TIME_PER_REQUEST = Histogram(
+    "db_time_per_request_seconds", "Time spent in database statements per HTTP request",
+    ["route"], buckets=DB_BUCKETS,
+)
+
+
+class _RequestDbStats:
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+_request_db_stats: ContextVar[Optional[_RequestDbStats]] = ContextVar("request_db_stats", default=None)
+
+
+def instrument_engine(engine):
+    """Time every statement executed through ``engine`` (sync or async)."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context._query_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._query_started
+        DB_QUERY_DURATION.observe(elapsed)
+        stats = _request_db_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.seconds += elapsed
+
+
+# model -> moving average of generated tokens per completed reply
+_reply_tokens = {}
+
+
+def expected_reply_tokens(model: str) -> float:
+    """Typical reply length of ``model`` in tokens (0 until one completed)."""
+    return _reply_tokens.get(model, 0.0)
+
+
+def observe_llm_result(model: str, mode: str, started: float, data: dict):
+    LLM_REQUEST_DURATION.labels(model, mode).observe(time.perf_counter() - started)
+    eval_count = data.get("eval_count")
+    eval_duration = data.get("eval_duration")
+    if eval_count and eval_duration:
+        LLM_TOKENS_PER_SECOND.labels(model).observe(eval_count / (eval_duration / 1e9))
+    if eval_count:
+        previous = _reply_tokens.get(model)
+        _reply_tokens[model] = eval_count if previous is None else 0.9 * previous + 0.1 * eval_count
+
+
+def observe_cancelled(model: str, reason: str, generated_tokens: int):
+    LLM_GENERATIONS_CANCELLED.labels(model, reason).inc()
+    saved = expected_reply_tokens(model) - generated_tokens
+    if saved > 0:
+        LLM_TOKENS_SAVED.labels(model).inc(saved)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, in-flight count and DB usage per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        stats = _RequestDbStats()
+        token = _request_db_stats.set(stats)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight = HTTP_REQUESTS_IN_FLIGHT.labels(method)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            _request_db_stats.reset(token)
+            # FastAPI stores the matched route in the scope; use its template
+            # rather than the raw path to keep label cardinality bounded.
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            HTTP_REQUEST_DURATION.labels(method, route_path, str(status)).observe(
+                time.perf_counter() - started
+            )
+            DB_QUERIES_PER_REQUEST.labels(route_path).observe(stats.queries)
+            DB_TIME_PER_REQUEST.labels(route_path).observe(stats.seconds)
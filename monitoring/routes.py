@@ -0,0 +1,126 @@
+from fastapi import APIRouter, Depends, Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from authentication.principal_cache import principal_cache
+from chat.cache import response_cache
+from chat.llm_client import llm_client
+from chat.cancellation import generation_registry
+from chat.ratelimit import rate_limiter
+from chat.scheduler import scheduler
+from chat.usage import usage_accountant
+from database import pool_stats
+from dependencies import get_admin_user
+
+# The JSON views expose backend URLs and internal state; only /metrics is open.
+router = APIRouter(prefix="/monitoring", tags=["Monitoring"], dependencies=[Depends(get_admin_user)])
+metrics_router = APIRouter(tags=["Monitoring"])
+admin_router = APIRouter(prefix="/admin", tags=["Admin"], dependencies=[Depends(get_admin_user)])
+
+
+class AppStatsCollector:
+    """Exports pool, scheduler and cache state at scrape time."""
+
+    def collect(self):
+        pool_size = GaugeMetricFamily("db_pool_size", "Configured connection pool size", labels=["engine"])
+        checked_out = GaugeMetricFamily("db_pool_checked_out", "Connections in use", labels=["engine"])
+        overflow = GaugeMetricFamily("db_pool_overflow", "Overflow connections open", labels=["engine"])
+        checkout_wait = CounterMetricFamily(
+            "db_pool_checkout_wait_seconds", "Total time spent waiting for a pooled connection", labels=["engine"]
+        )
+        checkout_timeouts = CounterMetricFamily(
+            "db_pool_checkout_timeouts", "Pool checkouts that timed out", labels=["engine"]
+        )
+        for name, stats in pool_stats().items():
+            if "size" not in stats:
+                continue
+            pool_size.add_metric([name], stats["size"])
+            checked_out.add_metric([name], stats["checked_out"])
+            overflow.add_metric([name], stats["overflow"])
+            checkout_wait.add_metric([name], stats["avg_checkout_wait"] * stats["checkouts"])
+            checkout_timeouts.add_metric([name], stats["timeouts"])
+        yield from (pool_size, checked_out, overflow, checkout_wait, checkout_timeouts)
+
+        sched = scheduler.stats()
+        active = GaugeMetricFamily("generation_active", "Generations holding a scheduler slot", labels=["model"])
+        queued = GaugeMetricFamily("generation_queue_depth", "Generations waiting for a slot", labels=["model"])
+        for model, lane in sched["models"].items():
+            active.add_metric([model], lane["active"])
+            queued.add_metric([model], lane["queue_depth"])
+        yield from (active, queued)
+        yield CounterMetricFamily("generation_admitted", "Generations admitted by the scheduler", value=sched["admitted"])
+        yield CounterMetricFamily("generation_rejected", "Generations rejected by the scheduler", value=sched["rejected"])
+
+        cache = response_cache.stats()
+        yield CounterMetricFamily("response_cache_hits", "Response cache hits", value=cache["hits"])
+        yield CounterMetricFamily("response_cache_misses", "Response cache misses", value=cache["misses"])
+        yield CounterMetricFamily("response_cache_coalesced", "Requests joined to an in-flight generation",
+                                  value=cache["coalesced"])
+        yield GaugeMetricFamily("response_cache_bytes", "Text bytes held by the response cache", value=cache["bytes"])
+
+        healthy = GaugeMetricFamily("llm_backend_healthy", "Whether an LLM backend is in rotation", labels=["backend"])
+        outstanding = GaugeMetricFamily("llm_backend_outstanding", "Requests in flight per LLM backend",
+                                        labels=["backend"])
+        for url, backend in llm_client.stats().items():
+            healthy.add_metric([url], int(backend["healthy"]))
+            outstanding.add_metric([url], backend["outstanding"])
+        yield from (healthy, outstanding)
+
+        auth = principal_cache.stats()
+        yield CounterMetricFamily("principal_cache_hits", "Principal cache hits", value=auth["hits"])
+        yield CounterMetricFamily("principal_cache_misses", "Principal cache misses", value=auth["misses"])
+
+
+REGISTRY.register(AppStatsCollector())
+
+
+@metrics_router.get("/metrics")
+async def metrics():
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+
+@router.get("/scheduler")
+async def scheduler_stats():
+    return {**scheduler.stats(), "cancellable": generation_registry.stats()}
+
+
+@router.get("/backends")
+async def backend_stats():
+    return llm_client.stats()
+
+
+@router.get("/cache")
+async def cache_stats():
+    return response_cache.stats()
+
+
+@router.get("/auth")
+async def auth_stats():
+    return principal_cache.stats()
+
+
+@router.get("/db")
+async def db_stats():
+    return pool_stats()
+
+
+@router.get("/usage")
+async def usage_stats():
+    return {**usage_accountant.stats(), "rate_limited": rate_limiter.limited}
+
+
+@admin_router.get("/models")
+async def model_residency():
+    return llm_client.residency()
+
+
+@admin_router.post("/models/{model:path}/preload")
+async def preload_model(model: str):
+    """Load a model on every backend and keep it warm until evicted."""
+    return {"model": model, "backends": await llm_client.preload(model)}
+
+
+@admin_router.post("/models/{model:path}/evict")
+async def evict_model(model: str):
+    """Unload a model from every backend and stop keeping it warm."""
+    return {"model": model, "backends": await llm_client.evict(model)}
@@ -1,17 +1,35 @@
+import json
+
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import uuid
 
 BACKEND_URL = "http://localhost:8000"
+MODEL = "llama3.2"
+HISTORY_PAGE_SIZE = 200
+LIST_PAGE_SIZE = 200
 
 if "page" not in st.session_state:
     st.session_state.page = "login"
 if "jwt_token" not in st.session_state:
     st.session_state.jwt_token = None
+# Conversation list with its ETag; revalidated on every rerun
 if "conv_list" not in st.session_state:
-    st.session_state.conv_list = []
+    st.session_state.conv_list = None
+    st.session_state.conv_list_etag = None
+# conv_id -> messages with ids, fetched once and then extended incrementally
+if "histories" not in st.session_state:
+    st.session_state.histories = {}
 
 
+def http():
+    """Keep-alive session of this browser tab, reused across reruns."""
+    if "http" not in st.session_state:
+        session = requests.Session()
+        session.mount(BACKEND_URL, HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        st.session_state.http = session
+    return st.session_state.http
 
 def auth_headers():
     if st.session_state.jwt_token:
@@ -22,20 +40,96 @@ def navigate_to(page):
     st.session_state.page = page
     if page == "login" or page == "registration":
         st.session_state.jwt_token = None
+        st.session_state.conv_list = None
+        st.session_state.histories = {}
     st.rerun()
 
 def get_all_conversations():
+    """All conversations, newest activity first, revalidated each rerun so
+    titles written in the background, the order and previews stay current.
+
+    Only the first page is revalidated: any activity moves a conversation to
+    it, so an unchanged first page means the cached list is still current.
+    The remaining pages are followed by ``next_cursor``.
+    """
+    headers = auth_headers()
+    if st.session_state.conv_list is not None and st.session_state.conv_list_etag:
+        # Unchanged lists come back as an empty 304.
+        headers["If-None-Match"] = st.session_state.conv_list_etag
     try:
-        response = requests.get(
+        response = http().get(
             f"{BACKEND_URL}/conversation/list",
-            headers=auth_headers()
+            params={"limit": LIST_PAGE_SIZE},
+            headers=headers
         )
+        if response.status_code == 304:
+            return st.session_state.conv_list
         response.raise_for_status()
-        return response.json()  # Список id
+        page = response.json()
+        conversations = page["conversations"]  # Сначала недавние
+        etag = response.headers.get("ETag")
+        while page["next_cursor"]:
+            response = http().get(
+                f"{BACKEND_URL}/conversation/list",
+                params={"limit": LIST_PAGE_SIZE, "cursor": page["next_cursor"]},
+                headers=auth_headers()
+            )
+            response.raise_for_status()
+            page = response.json()
+            conversations += page["conversations"]
+        st.session_state.conv_list = conversations
+        st.session_state.conv_list_etag = etag
+        return conversations
     except requests.RequestException as e:
         st.error(f"Failed to fetch conversation list: {e}")
         return []
 
+def get_history_page(conv_id, **cursor):
+    response = http().get(
+        f"{BACKEND_URL}/conversation/{conv_id}",
+        params={"limit": HISTORY_PAGE_SIZE, **cursor},
+        headers=auth_headers()
+    )
+    response.raise_for_status()
+    return response.json()
+
+def get_messages(conv_id):
+    """Messages of a conversation: the whole history the first time (paging
+    backwards), afterwards only the ones newer than the last cached message."""
+    messages = st.session_state.histories.get(conv_id)
+    if messages:
+        while True:
+            page = get_history_page(conv_id, after=messages[-1]["id"])
+            messages = messages + page["messages"]
+            if not page["has_more"] or not page["messages"]:
+                break
+    else:
+        page = get_history_page(conv_id)
+        messages = page["messages"]
+        while page["has_more"] and page["messages"]:
+            page = get_history_page(conv_id, before=messages[0]["id"])
+            messages = page["messages"] + messages
+    st.session_state.histories[conv_id] = messages
+    return messages
+
+def stream_reply(conv_id, prompt):
+    """Yield reply tokens as the backend streams them (NDJSON events)."""
+    with http().post(
+        f"{BACKEND_URL}/conversation/{conv_id}/message",
+        json={"prompt": prompt, "model": MODEL, "stream": True},
+        headers=auth_headers(),
+        stream=True,
+    ) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            if "token" in event:
+                yield event["token"]
+            elif "error" in event:
+                raise requests.RequestException(event["error"])
+
 if st.session_state.page == "login":
     st.title("Login - Chat Application")
 
@@ -44,7 +138,7 @@ if st.session_state.page == "login":
 
     if st.button("Login"):
         try:
-            response = requests.post(
+            response = http().post(
                 f"{BACKEND_URL}/auth/login",
                 json={"username": username, "password": password}
             )
@@ -70,7 +164,7 @@ elif st.session_state.page == "registration":
     new_password = st.text_input("New Password(minimum: 8)", type="password", key="register_password")
 
     if st.button("Register"):
-        resp = requests.post(
+        resp = http().post(
             f"{BACKEND_URL}/auth/register",
             json={"username": new_username,
                   "password": new_password}
@@ -95,7 +189,7 @@ elif st.session_state.page == "chat":
     if not names:
         new_conv_id = str(uuid.uuid4())
         default_name = "New Chat"
-        resp = requests.post(
+        resp = http().post(
             f"{BACKEND_URL}/conversation/start",
             params={"conv_id": new_conv_id, "conv_name": default_name},
             headers=auth_headers()
@@ -103,6 +197,7 @@ elif st.session_state.page == "chat":
         if resp.ok:
             names = [default_name]
             name_to_id = {default_name: new_conv_id}
+            st.session_state.histories[new_conv_id] = []
         else:
             st.error("Failed to initialize first conversation.")
             st.stop()
@@ -113,6 +208,11 @@ elif st.session_state.page == "chat":
         st.session_state.conv_index = 0
         if "conv_name" not in st.session_state:
             st.session_state.conv_name = names[st.session_state.conv_index]
+    # The list is ordered by activity, so keep the open conversation selected
+    # wherever it moved.
+    ids = [name_to_id[name] for name in names]
+    if st.session_state.get("conv_id") in ids:
+        st.session_state.conv_index = ids.index(st.session_state.conv_id)
 
     selected_name = st.sidebar.selectbox(
         "Choose conversation:",
@@ -123,7 +223,7 @@ elif st.session_state.page == "chat":
     if st.sidebar.button("➕ New conversation"):
         new_conv_id = str(uuid.uuid4())
         default_name = "New Chat " + str(len(names))
-        resp = requests.post(
+        resp = http().post(
             f"{BACKEND_URL}/conversation/start",
             params={"conv_id": new_conv_id, "conv_name": default_name},
             headers=auth_headers()
@@ -132,8 +232,10 @@ elif st.session_state.page == "chat":
 
             name_to_id[default_name] = new_conv_id
             names.append(default_name)
+            st.session_state.histories[new_conv_id] = []
             st.session_state.conv_index = names.index(default_name)
             st.session_state.conv_name = default_name
+            st.session_state.conv_id = new_conv_id
             st.rerun()
         else:
             st.error("Failed to start a new conversation.")
@@ -141,6 +243,10 @@ elif st.session_state.page == "chat":
 
     selected_conv_id = name_to_id[selected_name]
 
+    if st.sidebar.button("🔄 Refresh"):
+        st.session_state.histories = {}
+        st.rerun()
+
     if st.sidebar.button("Logout"):
         st.session_state.jwt_token = None
         navigate_to("login")
@@ -150,75 +256,45 @@ elif st.session_state.page == "chat":
     if "conv_id" not in st.session_state or st.session_state.conv_id != selected_conv_id:
         st.session_state.conv_id = selected_conv_id
 
-    try:
-        response = requests.get(
-            f"{BACKEND_URL}/conversation/{st.session_state.conv_id}",
-            headers=auth_headers()
-        )
-        response.raise_for_status()
-        st.session_state.messages = response.json()["messages"]
-    except requests.RequestException as e:
-        st.error(f"Failed to fetch conversation history: {e}")
-        st.stop()
+    if st.session_state.conv_id not in st.session_state.histories:
+        try:
+            get_messages(st.session_state.conv_id)
+        except requests.RequestException as e:
+            st.error(f"Failed to fetch conversation history: {e}")
+            st.stop()
+    st.session_state.messages = st.session_state.histories[st.session_state.conv_id]
 
 
 
     # Display chat messages from history
     for message in st.session_state.messages:
         role = "assistant" if message["role"] == "model" else message["role"]
-        with st.chat_message(message["role"]):
+        with st.chat_message(role):
             st.markdown(message["content"])
 
     # Handle user input
     if prompt := st.chat_input("What is up?"):
-        # Add user message
-        st.session_state.messages.append({"role": "user", "content": prompt})
-
         with st.chat_message("user"):
             st.markdown(prompt)
 
-        # Send message to backend and get response
+        # Render the reply token by token as it is generated. A rerun in the
+        # middle closes the connection, which also stops the generation.
+        replied = False
         with st.chat_message("assistant"):
             try:
-                response = requests.post(
-                    f"{BACKEND_URL}/conversation/{st.session_state.conv_id}/message",
-                    json={"prompt": prompt, "model": "llama3.2"},
-                    headers=auth_headers()
-                )
-                response.raise_for_status()
-                reply = response.json()["generated_text"]
-
-                # Add assistant reply
-                st.session_state.messages.append({"role": "assistant", "content": reply})
-                st.markdown(reply)
-
-                # Set new conversation name if it's the first message
-                if len(st.session_state.messages) <= 2:
-                    new_conv_name = requests.post(
-                        f"{BACKEND_URL}/generation/generate_chat_name",
-                        json={"prompt": prompt, "model": "llama3.2"},
-                        headers=auth_headers()
-                    ).json()["generated_text"][1:-1]
-                    resp = requests.post(
-                        f"{BACKEND_URL}/conversation/{st.session_state.conv_id}/rename",
-                        params={"conv_id": st.session_state.conv_id,
-                                "conv_name": new_conv_name},
-                        headers=auth_headers()
-                    )
-                    if resp.status_code == 200:
-                        name_to_id[new_conv_name] = st.session_state.conv_id
-                        names.append(new_conv_name)
-                        st.session_state.conv_index = names.index(new_conv_name)
-
-                        names.remove(st.session_state.conv_name)
-                        name_to_id.pop(st.session_state.conv_name)
-
-                        st.session_state.conv_index = names.index(new_conv_name)
-                        st.session_state.conv_name = new_conv_name
-
-                        st.rerun()
-                    else:
-                        st.error("Failed to generate new chat name.")
-                        st.stop()
+                st.write_stream(stream_reply(st.session_state.conv_id, prompt))
+                replied = True
             except requests.RequestException as e:
-                st.error(f"Error communicating with the backend: {e}")
\ No newline at end of file
+                st.error(f"Error communicating with the backend: {e}")
+
+        # Pick up the stored turn (with its ids) instead of refetching everything.
+        try:
+            get_messages(st.session_state.conv_id)
+        except requests.RequestException:
+            st.session_state.histories.pop(st.session_state.conv_id, None)
+
+        # Rerun so the sidebar revalidates the list: the turn moved this
+        # conversation to the top and changed its preview (and, after the
+        # first reply, the backend names the conversation).
+        if replied:
+            st.rerun()